@@ -0,0 +1,62 @@
+'''
+Script to generate synthetic daily price data and its universe file
+
+    python generate_data.py --num_tickers 5000 --num_years 30 --random_seed 1 --num_workers 0
+    python run_backtest.py --universe_name "Synthetic Universe" --data_dir ../data/synthetic
+'''
+
+# import native libraries
+import os
+import sys
+import time
+import datetime
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "strategy"))
+
+# import the internal libraries
+import preference
+from synthetic import SyntheticMarket
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name', dest='universe_name', default = 'Synthetic Universe', help='Name of the Universe')
+    parser.add_argument('--random_seed', dest='random_seed', default = None, type = int, help='Random Seed')
+    parser.add_argument('--num_tickers', dest='num_tickers', default = 5000, type = int, help='Number of tickers')
+    parser.add_argument('--num_years', dest='num_years', default = 30, type = int, help='Number of years of history, ending at --end_date')
+    parser.add_argument('--gap_rate', dest='gap_rate', default = 0.002, type = float, help='Probability of a missing date')
+    parser.add_argument('--halt_rate', dest='halt_rate', default = 0.1, type = float, help='Number of trading halts (2 to 10 missing dates) per year')
+    parser.add_argument('--listing_rate', dest='listing_rate', default = 0.3, type = float, help='Fraction of the tickers listed after the first date')
+    parser.add_argument('--delisting_rate', dest='delisting_rate', default = 0.1, type = float, help='Fraction of the tickers delisted before the last date')
+    parser.add_argument('--split_rate', dest='split_rate', default = 0.05, type = float, help='Number of stock splits per year')
+    parser.add_argument('--jump_rate', dest='jump_rate', default = 2.0, type = float, help='Number of price jumps per year')
+    parser.add_argument('--dividend_rate', dest='dividend_rate', default = 0.3, type = float, help='Fraction of the tickers paying quarterly dividends')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    if pref.data_dir is None:
+        pref.data_dir = os.path.join(pref.data_root_dir, 'synthetic')
+
+    end_date = pref.end_date
+    start_date = datetime.date(end_date.year - pref.num_years, end_date.month, end_date.day)
+
+    market = SyntheticMarket(pref.num_tickers, start_date, end_date, seed = pref.random_seed,
+                             gap_rate = pref.gap_rate, halt_rate = pref.halt_rate,
+                             listing_rate = pref.listing_rate, delisting_rate = pref.delisting_rate,
+                             split_rate = pref.split_rate, jump_rate = pref.jump_rate, dividend_rate = pref.dividend_rate)
+    print(f"Generating {pref.num_tickers} tickers from {start_date} to {end_date} (seed {market.seed})")
+
+    start = time.perf_counter()
+    num_rows = market.write(pref.data_dir, pref.meta_data_dir, pref.universe_name, num_workers = pref.num_workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"Completed in {elapsed:.1f}s, {num_rows} rows in {pref.data_dir}, "
+          f"universe {pref.universe_name} in {pref.meta_data_dir}")
+
+if __name__ == "__main__":
+    run()
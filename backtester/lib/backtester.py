@@ -3,12 +3,16 @@ Main driver class for the backtester
 
 '''
 import os
+import copy
 import datetime
+import concurrent.futures
 
 import preference
 import common as cm
+import profiler
 
-from datamatrix import DataMatrixLoader
+from datamatrix import DataMatrixLoader, share_with_workers
+from writer import OutputWriter
 from longindex_strategy import LongIndexStrategy
 
 class Driver(object):
@@ -23,7 +27,13 @@ class Driver(object):
         self.benchmark_etf = cm.get_ETF_by_index(pref.universe_name)
         self.datamatrix_loader = DataMatrixLoader(pref, pref.universe_name, self.universe, pref.start_date, pref.end_date)
         self.strategy_list = []
+        self.benchmark = None
+        self.benchmark_pending = False
+        self.writer = OutputWriter(pref.output_dir, pref.num_writers)
         self.run_date = None
+        self.profiler = None
+        if pref.profile or pref.profile_memory:
+            self.profiler = profiler.enable(trace_memory = pref.profile_memory)
 
         print(
     """
@@ -40,29 +50,99 @@ class Driver(object):
         info += f"\nRun date: {self.run_date}"
         return(info)
 
+    def get_num_workers(self):
+        num_workers = self.pref.num_workers
+        if num_workers is None or num_workers <= 0:
+            num_workers = os.cpu_count()
+        return num_workers
+
     def run(self, strategy_list):
+        '''
+        run the strategies, in a process pool when pref.num_workers is not 1.
+        A benchmark deferred by run_benchmark runs along with them
+        '''
         self.run_date = datetime.datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-        self.strategy_list = strategy_list
 
+        tasks = list(strategy_list)
+        if self.benchmark_pending:
+            tasks.insert(0, self.benchmark)
+
+        results = self.execute(tasks)
+
+        if self.benchmark_pending:
+            self.benchmark = results.pop(0)
+            self.benchmark_pending = False
+            self.print_benchmark()
+        self.strategy_list = results
+
+    def execute(self, strategy_list):
+        '''
+        validate, run and save each strategy in place, return the strategies in the same order.
+        Without a process pool, the outputs are saved by the background writer while the next strategy runs.
+        The workers of the process pool get the input DataMatrix objects when they start, either inherited by fork
+        or sent through shared memory. Each task sends a strategy without its DataMatrix and its pricing matrix,
+        which the worker rebuilds from the DataMatrix. Each worker sends back its strategy without the input DataMatrix,
+        whose state is copied into the strategy of the caller
+        '''
+        num_workers = min(self.get_num_workers(), len(strategy_list))
+        if num_workers <= 1:
+            for strategy in strategy_list:
+                _run_stages(strategy)
+                self.writer.submit(strategy)
+            return list(strategy_list)
+
+        # the strategies often run on the same DataMatrix, each one is sent once
+        dm_index = {}
+        for strategy in strategy_list:
+            dm_index.setdefault(id(strategy.input_dm), (len(dm_index), strategy.input_dm))
+        dms = [dm for _, dm in dm_index.values()]
+        tasks = []
         for strategy in strategy_list:
-            strategy.validate()
-            strategy.run_strategy()
-            strategy.save_to_csv(self.pref.output_dir)
+            task = copy.copy(strategy)
+            task.input_dm = None
+            task.pricing_matrix = None
+            tasks.append((task, dm_index[id(strategy.input_dm)][0]))
+
+        trace_memory = None if self.profiler is None else self.profiler.trace_memory
+        shared = share_with_workers(dms)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers, initializer = _init_worker,
+                                                        initargs = (dms, self.pref.output_dir, trace_memory)) as executor:
+                results = list(executor.map(_run_strategy, tasks))
+        finally:
+            for owner in shared:
+                owner.close()
+
+        # copy the state of each worker's strategy back into the caller's object, as the serial path updates it in place
+        for strategy, (result, records) in zip(strategy_list, results):
+            input_dm = strategy.input_dm
+            strategy.__dict__.update(result.__dict__)
+            strategy.input_dm = input_dm
+            if records is not None:
+                self.profiler.add_records(records)
+        return list(strategy_list)
 
     def run_benchmark(self):
         '''
         for each backtest, we have index ETF as its benchmark for comparison.
-        For example, long SPY for S&P 500 universe
+        For example, long SPY for S&P 500 universe.
+        When the strategies run in a process pool, the benchmark is deferred to run with them
         '''
         etf_universe = [self.benchmark_etf]
-        loader = DataMatrixLoader(self.pref, self.pref.universe_name, etf_universe, self.pref.start_date, self.pref.end_date)
-        dm = loader.get_daily_datamatrix()
+        with profiler.stage('load', 'Benchmark'):
+            loader = DataMatrixLoader(self.pref, self.pref.universe_name, etf_universe, self.pref.start_date, self.pref.end_date)
+            dm = loader.get_daily_datamatrix()
 
-        buyETF = LongIndexStrategy(self.pref, dm, cm.OneMillion, index_name = self.benchmark_etf)
-        buyETF.validate()
-        buyETF.run_strategy()
-        buyETF.save_to_csv(self.pref.output_dir)
+        self.benchmark = LongIndexStrategy(self.pref, dm, cm.OneMillion, index_name = self.benchmark_etf)
+        if self.get_num_workers() > 1:
+            self.benchmark_pending = True
+            return
 
+        self.execute([self.benchmark])
+        self.print_benchmark()
+
+    def print_benchmark(self):
+        buyETF = self.benchmark
         print(f"""
 +-----------------------------------------------+
 |            Benchmark Performance              |
@@ -85,8 +165,11 @@ Max Drawdown:          {buyETF.performance['Maximum Drawdown']:.3f}%
 
     def summary(self):
         '''
-        print out summary of the result
+        print out summary of the result, once all the outputs are saved.
+        Raise an Exception if some of them could not be saved
         '''
+        self.writer.wait()
+
         print(f"""
 +-----------------------------------------------+
 |               Backtester Summary              |
@@ -112,12 +195,69 @@ Performance:
 ==================================================
             """)
 
+        if self.profiler is not None:
+            self.print_profile()
+
         print(f"""
 +-----------------------------------------------+
 |              Backtester Completed             |
 +-----------------------------------------------+
         """)
 
+    def print_profile(self):
+        '''
+        print the time (and memory peak) of each stage and save them to profile.json in the output directory
+        '''
+        fname = os.path.join(self.pref.output_dir, 'profile.json')
+        self.save_profile(fname)
+        print(f"""
++-----------------------------------------------+
+|              Backtester Profile               |
++-----------------------------------------------+
+{self.profiler.format_table()}
+
+Saved to {fname}""")
+
+    def save_profile(self, fname):
+        os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok = True)
+        self.profiler.save_to_json(fname)
+
+
+def _run_stages(strategy):
+    with profiler.stage('validate', strategy.name):
+        strategy.validate()
+    with profiler.stage('run_strategy', strategy.name):
+        strategy.run_strategy()
+
+# the input DataMatrix objects of a worker process, set once by the pool initializer
+_worker_dms = None
+_worker_output_dir = None
+
+def _init_worker(dms, output_dir, trace_memory):
+    '''
+    trace_memory is None when the parent does not profile, otherwise the worker records its own stages
+    '''
+    global _worker_dms, _worker_output_dir
+    _worker_dms = dms
+    _worker_output_dir = output_dir
+    if trace_memory is None:
+        profiler.disable()
+    else:
+        profiler.enable(trace_memory)
+
+def _run_strategy(task):
+    '''
+    run a strategy on the k-th DataMatrix of the worker, return it along with the stages recorded (None when not profiling)
+    '''
+    strategy, k = task
+    strategy.input_dm = _worker_dms[k]
+    strategy.pricing_matrix = strategy.get_pricing_matrix()
+    _run_stages(strategy)
+    strategy.save_output(_worker_output_dir)
+    # the caller has the DataMatrix already
+    strategy.input_dm = None
+    active = profiler.get_profiler()
+    return (strategy, None if active is None else active.collect())
 
 # ==============================================
 # Testing
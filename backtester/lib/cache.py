@@ -0,0 +1,224 @@
+'''
+Classes for caching parsed data on disk
+'''
+
+import os
+import hashlib
+import numpy as np
+
+
+class PriceCache(object):
+
+    '''
+    Persistent columnar cache of parsed price files.
+    Each source file is stored as an uncompressed npz archive with the dates and one array per column,
+    together with a fingerprint (size and modification time) of the source file.
+    An entry is only used while the fingerprint still matches, otherwise the caller rebuilds it.
+    '''
+
+    _version = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_cache_fname(self, src_fname):
+        '''
+        cache files are grouped by source directory, the directory hash avoids collision between
+        data directories sharing the same name
+        '''
+        src_dir, base = os.path.split(os.path.abspath(src_fname))
+        tag = hashlib.sha1(src_dir.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"{os.path.basename(src_dir)}_{tag}", os.path.splitext(base)[0] + '.npz')
+
+    def get_fingerprint(self, src_fname):
+        st = os.stat(src_fname)
+        return np.array([PriceCache._version, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+    def load(self, src_fname, fingerprint):
+        '''
+        return (dates, columns) stored for src_fname, or None if there is no valid entry
+        '''
+        fname = self.get_cache_fname(src_fname)
+        if not os.path.exists(fname):
+            return None
+
+        try:
+            with np.load(fname, allow_pickle=False) as data:
+                if not np.array_equal(data['_fingerprint'], fingerprint):
+                    return None
+                dates = data['_dates']
+                columns = {name: data[f"c{i}"] for i, name in enumerate(data['_columns'].tolist())}
+        except (OSError, ValueError, KeyError):
+            # unreadable or partially written entry, treat as a miss
+            return None
+
+        return (dates, columns)
+
+    def save(self, src_fname, fingerprint, dates, columns):
+        '''
+        store the parsed columns of src_fname, the file is written to a temporary name first
+        so that concurrent readers never see a partial entry
+        '''
+        fname = self.get_cache_fname(src_fname)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+        arrays = {'_fingerprint': fingerprint, '_dates': dates, '_columns': np.array(list(columns.keys()))}
+        for i, values in enumerate(columns.values()):
+            values = np.asarray(values)
+            arrays[f"c{i}"] = values.astype(str) if values.dtype == object else values
+
+        tmp_fname = f"{fname}.{os.getpid()}.tmp"
+        with open(tmp_fname, 'wb') as fout:
+            np.savez(fout, **arrays)
+        os.replace(tmp_fname, fname)
+
+
+class IndicatorCache(object):
+
+    '''
+    Persistent cache of calculated indicators, each entry is one uncompressed npz file holding a dates x tickers array
+    and, for every ticker, the fingerprint of its source file.
+    The key is a digest of the indicator name (which carries its parameters), the fingerprint of its code, the dates
+    and the tickers, so an entry is never used once the calculation has changed. Within an entry, only the tickers
+    whose source file has changed since it was saved are calculated again, the other columns are kept.
+    The total size is bounded by max_bytes, the least recently used entries are evicted first.
+    '''
+
+    _version = 2
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # running size of the entries, None until the directory is scanned
+        self._total_bytes = None
+
+    def get_key(self, name, dates, tickers, code = ''):
+        '''
+        tickers are the columns of the entry, code the fingerprint of the calculation (indicator.get_fingerprint)
+        '''
+        digest = hashlib.sha1(f"{IndicatorCache._version}|{name}|{code}|".encode('utf-8'))
+        digest.update(np.ascontiguousarray(dates, dtype='datetime64[D]').tobytes())
+        digest.update('|'.join(tickers).encode('utf-8'))
+        return f"{name}_{digest.hexdigest()}"
+
+    def get_cache_fname(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        '''
+        return the array stored for key and the fingerprints of its sources, or (None, None) if there is no valid entry
+        '''
+        fname = self.get_cache_fname(key)
+        try:
+            with np.load(fname, allow_pickle=False) as data:
+                values = data['values']
+                sources = data['sources']
+            # the modification time records the last use for the LRU eviction
+            os.utime(fname)
+        except (OSError, ValueError, KeyError):
+            return (None, None)
+        return (values, sources)
+
+    def save(self, key, values, sources):
+        fname = self.get_cache_fname(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        tmp_fname = f"{fname}.{os.getpid()}.tmp"
+        with open(tmp_fname, 'wb') as fout:
+            np.savez(fout, values=values, sources=np.array(sources, dtype=str))
+            size = fout.tell()
+        os.replace(tmp_fname, fname)
+
+        # only scan the directory when the running size goes over the limit, so that filling the cache
+        # does not stat every entry on every save. The running size counts a replaced entry twice
+        # and misses the entries of other processes, the scan corrects it
+        if self._total_bytes is None:
+            self.evict()
+        else:
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self.evict()
+
+    def get(self, key, sources, func):
+        '''
+        return the cached array for key, sources being the fingerprints of its columns.
+        func(columns) calculates the columns given by an index array, or all of them when columns is None.
+        On a miss all the columns are calculated, otherwise only those whose fingerprint has changed,
+        and the entry is stored again
+        '''
+        values, saved = self.load(key)
+        sources = np.array(sources, dtype=str)
+        if values is None or saved.shape != sources.shape:
+            values = func(None)
+        else:
+            stale = np.flatnonzero(saved != sources)
+            if len(stale) == 0:
+                return values
+            if values.ndim == 1 or len(stale) == len(sources):
+                values = func(None)
+            else:
+                values[:, stale] = func(stale)
+        self.save(key, values, sources)
+        return values
+
+    def evict(self):
+        '''
+        remove the least recently used entries when the cache does not fit in max_bytes, down to 90% of it
+        so that the next scan only happens after a tenth of the cache is written again
+        '''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            # the .npy entries of the previous version are no longer used, they go first as the least recently used
+            if entry.name.endswith('.npz') or entry.name.endswith('.npy'):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else 0.9 * self.max_bytes
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already removed by another process
+                pass
+            total -= size
+        self._total_bytes = total
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    src_fname = os.path.join(tmp_dir, 'AAA.csv')
+    with open(src_fname, 'w') as fout:
+        fout.write('Date,Close\n2020-01-02,1.0\n')
+
+    cache = PriceCache(os.path.join(tmp_dir, 'cache'))
+    fingerprint = cache.get_fingerprint(src_fname)
+    print('before save:', cache.load(src_fname, fingerprint))
+
+    dates = np.array(['2020-01-02'], dtype='datetime64[D]')
+    cache.save(src_fname, fingerprint, dates, {'Close': np.array([1.0]), 'Ticker': np.array(['AAA'], dtype=object)})
+    print('after save:', cache.load(src_fname, fingerprint))
+
+    with open(src_fname, 'a') as fout:
+        fout.write('2020-01-03,2.0\n')
+    print('after source change:', cache.load(src_fname, cache.get_fingerprint(src_fname)))
+
+    indicator_cache = IndicatorCache(os.path.join(tmp_dir, 'cache', 'indicators'), max_bytes=2000)
+    key = indicator_cache.get_key('SMA_2', dates, ['AAA', 'BBB'])
+    calculate = lambda columns: np.array([[1.0, 2.0]])[:, slice(None) if columns is None else columns]
+    print('indicator:', indicator_cache.get(key, ['AAA:1', 'BBB:1'], calculate), indicator_cache.load(key)[1])
+    # only the ticker whose source has changed is calculated again
+    print('after source change:', indicator_cache.get(key, ['AAA:1', 'BBB:2'], lambda columns: np.array([[5.0]])))
+    for i in range(3):
+        indicator_cache.save(indicator_cache.get_key('SMA_2', dates, [f"AA{i}"]), np.zeros((2, 1)), [f"AA{i}:1"])
+    print('after eviction:', indicator_cache.load(key)[0], len(os.listdir(indicator_cache.cache_dir)))
+
+if __name__ == '__main__':
+    _test()
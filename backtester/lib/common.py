@@ -75,17 +75,110 @@ class TradeAction(enum.Enum):
     SELL_TO_CLOSE_50  = "SELL_TO_CLOSE_50"      # sell 50 percent
     SELL_TO_CLOSE_25  = "SELL_TO_CLOSE_25"      # sell quarter position
 
+    @property
+    def code(self):
+        '''
+        int8 code of the trade action, it is the value stored in the trade action matrices
+        '''
+        return _trade_action_codes[self]
+
+# integer codes of the trade actions, NONE is 0
+_trade_actions = list(TradeAction)
+_trade_action_codes = {**{x: code for code, x in enumerate(_trade_actions)},
+                       **{x.value: code for code, x in enumerate(_trade_actions)}}
+_trade_action_values = np.array([x.value for x in _trade_actions], dtype = object)
+
+_buy_actions = [TradeAction.BUY, TradeAction.BUY_TO_CLOSE_ALL, TradeAction.BUY_TO_CLOSE_50, TradeAction.BUY_TO_CLOSE_25]
+_sell_actions = [TradeAction.SELL, TradeAction.SELL_TO_CLOSE_ALL, TradeAction.SELL_TO_CLOSE_50, TradeAction.SELL_TO_CLOSE_25]
+
+# lookup tables from code to buy or sell
+_is_buy_code = np.array([x in _buy_actions for x in _trade_actions])
+_is_sell_code = np.array([x in _sell_actions for x in _trade_actions])
+
+# a trade action can be given as a TradeAction, its value or its code
+_buy_keys = frozenset(_buy_actions + [x.value for x in _buy_actions] + [x.code for x in _buy_actions])
+_sell_keys = frozenset(_sell_actions + [x.value for x in _sell_actions] + [x.code for x in _sell_actions])
+
 def is_a_buy(trade_action):
-    return trade_action in [TradeAction.BUY, TradeAction.BUY_TO_CLOSE_ALL, TradeAction.BUY_TO_CLOSE_50, TradeAction.BUY_TO_CLOSE_25,
-                            TradeAction.BUY.value, TradeAction.BUY_TO_CLOSE_ALL.value, TradeAction.BUY_TO_CLOSE_50.value,
-                            TradeAction.BUY_TO_CLOSE_25.value
-                            ]
+    return trade_action in _buy_keys
 
 def is_a_sell(trade_action):
-    return trade_action in [TradeAction.SELL, TradeAction.SELL_TO_CLOSE_ALL, TradeAction.SELL_TO_CLOSE_50, TradeAction.SELL_TO_CLOSE_25,
-                            TradeAction.SELL.value, TradeAction.SELL_TO_CLOSE_ALL.value,
-                            TradeAction.SELL_TO_CLOSE_50.value, TradeAction.SELL_TO_CLOSE_25.value
-                            ]
+    return trade_action in _sell_keys
+
+def encode_trade_action(trade_action):
+    '''
+    integer code of a TradeAction, of its value or of its code (an integral float is a code as well).
+    None and NaN, the empty cells of a trade action DataFrame, are NONE. Anything else raises a ValueError
+    '''
+    if trade_action is None:
+        return 0
+    if isinstance(trade_action, (int, np.integer)):
+        return _check_codes(int(trade_action))
+    if isinstance(trade_action, (float, np.floating)):
+        if np.isnan(trade_action):
+            return 0
+        if trade_action.is_integer():
+            return _check_codes(int(trade_action))
+    elif trade_action in _trade_action_codes:
+        return _trade_action_codes[trade_action]
+    raise ValueError(f"Unknown trade action {trade_action!r}")
+
+def decode_trade_action(code):
+    return _trade_actions[code]
+
+def encode_trade_actions(trade_actions):
+    '''
+    int8 array of codes from an array of trade actions, which can already be codes (integers or integral floats).
+    None and NaN are NONE, anything else that is not a trade action raises a ValueError
+    '''
+    trade_actions = np.asarray(trade_actions)
+    if np.issubdtype(trade_actions.dtype, np.integer):
+        return _check_codes(trade_actions).astype(np.int8)
+    if np.issubdtype(trade_actions.dtype, np.floating):
+        codes = np.nan_to_num(trade_actions, nan = 0)
+        invalid = codes != np.floor(codes)
+        if invalid.any():
+            raise ValueError(f"Trade action codes should be integers, received {codes[invalid][0]}")
+        return _check_codes(codes).astype(np.int8)
+
+    # the few distinct values are encoded one by one. None and NaN are factorized as -1,
+    # which picks the NONE appended at the end of the lookup
+    labels, uniques = pd.factorize(trade_actions.ravel())
+    lookup = np.array([encode_trade_action(x) for x in uniques] + [0], dtype = np.int8)
+    return lookup[labels].reshape(trade_actions.shape)
+
+def _check_codes(codes):
+    '''
+    raise a ValueError if a code (or an array of codes) is not the code of a TradeAction
+    '''
+    values = np.asarray(codes)
+    invalid = (values < 0) | (values >= len(_trade_actions))
+    if invalid.any():
+        raise ValueError(f"Trade action codes should be in [0, {len(_trade_actions)}), received {values[invalid].ravel()[0]}")
+    return codes
+
+def decode_trade_actions(codes):
+    '''
+    array of the values (str) of an array of codes, used when writing trade actions to csv files
+    '''
+    return _trade_action_values[codes]
+
+def is_buy(codes):
+    '''
+    vectorized is_a_buy on an array of codes
+    '''
+    return _is_buy_code[codes]
+
+def is_sell(codes):
+    return _is_sell_code[codes]
+
+def get_trade_mask(taction):
+    '''
+    boolean array of the cells of a trade action DataFrame holding a buy or a sell.
+    The DataFrame holds codes, or TradeAction and their values for older strategies
+    '''
+    codes = encode_trade_actions(taction.to_numpy())
+    return is_buy(codes) | is_sell(codes)
 
 class TradeSignal(enum.Enum):
     SHORT = -1
@@ -118,7 +211,8 @@ def get_ETF_by_index(index):
             'OwlHack 2024 Universe': 'SPY',
             'Small Universe': 'SPY',
             'Test Universe': 'SPY'}
-    return _map[index]
+    # other universes, e.g. the synthetic ones, are benchmarked against SPY
+    return _map.get(index, 'SPY')
 
 def get_sector():
     return ['Basic Materials', 'Communication Services', 'Consumer Cyclical',
@@ -141,12 +235,12 @@ def parse_date_str(txt):
         dt = datetime.datetime.strptime(txt, "%m/%d/%Y").date()
     return(dt)
 
-def calculate_sharpe_ratio(daily_returns, risk_free_rate):
+def calculate_sharpe_ratio(daily_returns, risk_free_rate, axis = 0):
     # Calculate average daily return
-    avg_daily_return = np.mean(daily_returns)
+    avg_daily_return = np.mean(daily_returns, axis = axis)
 
     # Calculate daily standard deviation
-    daily_std_dev = np.std(daily_returns, ddof=1)
+    daily_std_dev = np.std(daily_returns, ddof=1, axis = axis)
 
     # Annualized the figures
     annualized_return = (1 + avg_daily_return) ** 252 - 1
@@ -161,22 +255,23 @@ def calculate_sharpe_ratio(daily_returns, risk_free_rate):
 
     return sharpe_ratio
 
-def calculate_max_drawdown(equity_values):
+def calculate_max_drawdown(equity_values, axis = 0):
     """
     Calculate the maximum drawdown of a time series of asset returns.
 
     :param equity_values: (Pandas Series) Time series of asset returns
+    :param axis: time axis when equity_values is a 2-D array of several series
 
     :return: Maximum drawdown of the asset returns in percentage
     """
     # Calculate the running maximum
-    running_max = np.maximum.accumulate(equity_values)
+    running_max = np.maximum.accumulate(equity_values, axis = axis)
 
     # Calculate drawdowns
     drawdowns = (equity_values - running_max) / running_max
 
     # Find the maximum drawdown
-    max_drawdown = np.min(drawdowns)
+    max_drawdown = np.min(drawdowns, axis = axis)
     return max_drawdown * 100
 
 # ==============================================
@@ -188,6 +283,16 @@ def _test():
     max_dd = calculate_max_drawdown(equity_values)
     print(f"Maximum Drawdown: {max_dd:.2%}")
 
+    # trade actions given as TradeAction, values, codes or float codes, empty cells are NONE
+    taction = pd.DataFrame([[TradeAction.BUY, 'SELL', None], [np.nan, 2.0, TradeAction.NONE]])
+    print(encode_trade_actions(taction.to_numpy()), get_trade_mask(taction))
+    print(get_trade_mask(pd.DataFrame([[1.0, np.nan], [0.0, 4.0]])))
+    for value in ['HOLD', 1.5, 42]:
+        try:
+            encode_trade_action(value)
+        except ValueError as e:
+            print(e)
+
 if __name__ == "__main__":
     import sys
     sys.path.append(os.getcwd())
@@ -5,13 +5,19 @@ Class to manage data set for a list of stocks and for a time period
 import os
 import datetime
 import copy
+import threading
+import functools
+import concurrent.futures
+import multiprocessing
 import pandas as pd
 import numpy as np
 
 import common as cm
+import indicator
+import profiler
 
 from loader import DataLoader
-from stock import Stock
+from panel import Panel, SharedPanel
 
 from preference import get_default_parser, Preference
 
@@ -22,8 +28,32 @@ class DataMatrix(pd.DataFrame):
     The columns are index by keys encoded usng {ticker}_{field}
     where field can be open, high, low, close, volume and calculated Technical indicators or fundamental quantities
     such as capitalization
+
+    The numeric values are also available as a Panel (date x ticker x field numpy array), which is the
+    preferred way to access a field for all tickers: field() returns a dates x tickers view without copying.
+    When the DataMatrix is built from a panel, the DataFrame columns are themselves a view of the panel.
+
+    A DataMatrix created by DataMatrixLoader knows the fingerprints of its source files (one per ticker),
+    derived fields are then looked up in the indicator cache. Assigning columns drops the fingerprints,
+    since the values may no longer match the source files.
+
+    After share(), the panel is also published in shared memory: pickling the DataMatrix, for instance
+    to send it to a worker process, then sends the name of the memory block instead of the values,
+    and the worker gets a read-only DataMatrix on the same memory. The derived fields it calculates
+    are kept by the worker aside from the shared memory and are not added as columns.
+
+    The columns are changed under lock, which a background writer holds while it saves the DataMatrix.
     '''
 
+    _metadata = ['_name', '_universe', '_timeframe']
+    _internal_names = pd.DataFrame._internal_names + ['_panel', '_indicator_cache', '_sources', '_shared', '_lock']
+    _internal_names_set = set(_internal_names)
+    _panel = None
+    _indicator_cache = None
+    _sources = None
+    _shared = None
+    _lock = None
+
     def __init__(self, *args, **kwargs):
         _name = kwargs.pop('name', None)
         _temp = kwargs.pop('universe', None)
@@ -32,6 +62,72 @@ class DataMatrix(pd.DataFrame):
         self._name = _name
         self._universe = _temp
         self._timeframe = _timeframe
+        self._panel = None
+        self._indicator_cache = None
+        self._sources = None
+        self._shared = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_panel(cls, panel, name = None, universe = None, timeframe = cm.TimeFrame.DAILY):
+        '''
+        create a DataMatrix whose columns share the memory of the panel
+        '''
+        index = pd.Index(panel.dates.astype(object), name = 'Date')
+        dm = cls(panel.to_2d().T, index = index, columns = panel.get_columns(), copy = False,
+                 name = name, universe = panel.tickers if universe is None else universe, timeframe = timeframe)
+        dm._panel = panel
+        return dm
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            # the panel is rebuilt from the columns on next access
+            self._panel = None
+            self._sources = None
+            self._shared = None
+
+    def _update_inplace(self, result, verify_is_copy = True):
+        '''
+        pandas replaces the data of in-place operations (dm *= 2, rename(inplace = True), ...) here,
+        the panel is rebuilt from the new columns on next access
+        '''
+        with self.lock:
+            super()._update_inplace(result, verify_is_copy = verify_is_copy)
+            self._panel = None
+            self._sources = None
+            self._shared = None
+
+    @property
+    def lock(self):
+        '''
+        reentrant lock held while the columns change, hold it to read the DataMatrix from another thread
+        '''
+        if self._lock is None:
+            self._lock = threading.RLock()
+        return self._lock
+
+    def __reduce__(self):
+        if self._shared is not None and not self._shared.closed:
+            return (_attach_datamatrix, (self._shared.descriptor, self._name, self._universe, self._timeframe,
+                                         self._indicator_cache, self._sources))
+        return super().__reduce__()
+
+    def share(self):
+        '''
+        publish the panel in shared memory and return its owner, close() it when the other processes are done.
+        Changing the DataMatrix afterwards stops sending it through the shared memory
+        '''
+        self._shared = SharedPanel(self.panel)
+        return self._shared
+
+    @property
+    def panel(self):
+        if self._panel is None:
+            with self.lock:
+                if self._panel is None:
+                    self._panel = Panel.from_frame(self, self.universe)
+        return self._panel
 
     @property
     def timeframe(self):
@@ -56,22 +152,112 @@ class DataMatrix(pd.DataFrame):
     @universe.setter
     def universe(self, value):
         self._universe = value
+        self._panel = None
+        self._sources = None
+        self._shared = None
 
     def get_info(self):
         info = f"Name: {self._name}, Universe: {self._universe}, TimeFrame: {self.timeframe}"
         return(info)
 
+    def field(self, fld):
+        '''
+        return the dates x tickers numpy view of one field, the columns follow the universe order.
+        A derived field from the indicator registry is calculated on first access and kept in the DataMatrix
+        '''
+        if not self.panel.has_field(fld) and indicator.is_derived(fld):
+            values = self._calc_derived_field(str(fld))
+            with self.lock:
+                if not self.panel.has_field(fld):
+                    self.add_field(fld, values)
+        return self.panel.field(fld)
+
+    def add_field(self, fld, values):
+        '''
+        add a dates x tickers array as a field, it becomes the {ticker}_{field} columns of the DataMatrix.
+        On a fixed panel (shared memory, date slice) the field is only kept aside by the panel, so that
+        the values are not copied: field() returns it but it is not a column
+        '''
+        with self.lock:
+            panel = self.panel
+            panel.add_field(fld, values)
+            if not indicator.is_derived(fld):
+                self._sources = None
+            if panel.fixed:
+                return
+            sources = self._sources
+
+            # rebuild the columns as a view of the panel, keeping any column that is not part of it
+            df = pd.DataFrame(panel.to_2d().T, index = self.index, columns = panel.get_columns(), copy = False)
+            others = self.columns.difference(df.columns, sort = False)
+            if len(others) > 0:
+                df = pd.concat([df, pd.DataFrame(self)[others]], axis = 1)
+            self._update_inplace(df)
+            # the columns are a view of the panel, which is still valid
+            self._panel = panel
+            self._sources = sources
+
+    def _calc_derived_field(self, fld):
+        '''
+        calculate a derived field for all tickers.
+        Missing prices are stored as 0 in the matrix, so they are treated as missing in the inputs
+        '''
+        def get_input(name):
+            values = self.field(name)
+            if not indicator.is_derived(name):
+                values = np.where(values == 0, np.nan, values)
+            return values
+
+        result = indicator.calculate_cached(fld, get_input, self._indicator_cache, self.panel.dates,
+                                            self.panel.tickers, self._sources)
+        result = np.where(np.isnan(result), 0, result)
+        return result
+
+    def slice_dates(self, lo, hi):
+        '''
+        return a DataMatrix on the dates [lo, hi) sharing the memory of this one, only the panel columns are kept
+        '''
+        return DataMatrix.from_panel(self.panel.slice_dates(lo, hi), name = self.name, universe = self.universe,
+                                     timeframe = self.timeframe)
 
     def extract_price_matrix(self, price_choice = cm.DataField.close):
         '''
-        return a datamatrix that has only the ticker_close columns
+        return a dataframe of price_choice with the ticker as column label
         '''
-        result = self[[f"{ticker}_{price_choice}" for ticker in self.universe]]
-        # keep only the ticker as column label
-        result.columns = [f"{col.split('_')[0]}" for col in result.columns]
+        result = pd.DataFrame(self.field(price_choice), index = self.index, columns = self.panel.tickers, copy = False)
         return(result)
 
 
+    def save_to_csv(self, fname, chunk_size = 1000):
+        '''
+        write the DataMatrix to a csv file, the fields kept aside by a fixed panel are written as the last columns.
+        They are joined to chunk_size rows at a time, so that the shared values are not copied as a whole
+        '''
+        with self.lock:
+            aside = self.panel.aside_fields if self._panel is not None else []
+            if len(aside) == 0:
+                self.to_csv(fname)
+                return
+
+            tickers = self.panel.tickers
+            columns = [f"{ticker}_{fld}" for fld in aside for ticker in tickers]
+            with open(fname, 'w', newline = '') as f:
+                for lo in range(0, max(len(self), 1), chunk_size):
+                    hi = lo + chunk_size
+                    values = np.hstack([self.panel.field(fld)[lo:hi] for fld in aside])
+                    chunk = pd.concat([pd.DataFrame(self.iloc[lo:hi]),
+                                       pd.DataFrame(values, index = self.index[lo:hi], columns = columns)], axis = 1)
+                    chunk.to_csv(f, header = (lo == 0))
+
+    def add_columns(self, data):
+        '''
+        add all the columns of data (a DataFrame with the same index) in one step
+        instead of inserting them one at a time, which would fragment the underlying blocks
+        '''
+        with self.lock:
+            result = pd.concat([pd.DataFrame(self).drop(columns = data.columns, errors = 'ignore'), data], axis = 1)
+            self._update_inplace(result)
+
     def copy_and_zero(self):
         dm = self.copy()
         for col in dm.columns:
@@ -111,21 +297,112 @@ class DataMatrixLoader(DataLoader):
 
     def get_daily_datamatrix(self, fields = None):
         '''
-        create datamatrix with columns as {ticker_field}
+        create datamatrix with columns as {ticker_field}, backed by a Panel of the numeric fields
+        The rows are the union of the trading dates of all tickers, missing values are set to 0
+        When pref.num_workers is not 1, the tickers are loaded in a process pool
+        The derived fields are calculated afterwards for all tickers at once
         '''
-        df = Stock(self, self.universe[0]).get_daily_hist_price(self.start_date,
-                                                                self.end_date).grab_fields(fields)
+        with profiler.stage('get_daily_datamatrix', self.name):
+            return self._get_daily_datamatrix(fields)
+
+    def _get_daily_datamatrix(self, fields):
+        if fields is None:
+            raw_fields = None
+            derived_fields = indicator.get_default_fields()
+        else:
+            fields = [str(fld) for fld in fields]
+            raw_fields = indicator.get_raw_inputs(fields)
+            derived_fields = [fld for fld in fields if indicator.is_derived(fld)]
+
+        num_workers = self.pref.num_workers
+        if num_workers is None or num_workers <= 0:
+            num_workers = os.cpu_count()
+
+        with profiler.stage('load'):
+            if num_workers > 1 and len(self.universe) > 1:
+                chunksize = max(1, len(self.universe) // (4 * num_workers))
+                with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers) as executor:
+                    blocks = list(executor.map(functools.partial(_load_ticker_block, self, raw_fields), self.universe,
+                                               chunksize = chunksize))
+            else:
+                blocks = [_load_ticker_block(self, raw_fields, ticker) for ticker in self.universe]
+
+        with profiler.stage('panel'):
+            calendar = self.get_trading_calendar([dates for dates, _, _ in blocks])
+            all_fields = list(dict.fromkeys(fld for _, tfields, _ in blocks for fld in tfields))
+
+            # copy every ticker block into the panel at the position of its dates in the calendar
+            panel = Panel(calendar, self.universe, all_fields)
+            values = panel.values
+            for j, (dates, tfields, block) in enumerate(blocks):
+                pos = slice(None) if len(dates) == len(calendar) else np.searchsorted(calendar, dates)
+                for k, fld in enumerate(tfields):
+                    values[panel.get_field_index(fld), j, pos] = block[k]
+
+        # the missing values are still NaN here, so that the indicators of each ticker are calculated on its own dates
+        cache = self.indicator_cache
+        sources = None if cache is None else [self.get_source_key(ticker) for ticker in self.universe]
+
+        def get_input(name):
+            if not panel.has_field(name):
+                panel.add_field(name, indicator.calculate_cached(name, get_input, cache, calendar, self.universe, sources))
+            return panel.field(name)
+
+        with profiler.stage('indicators'):
+            for fld in derived_fields:
+                get_input(fld)
+
+        if fields is not None and fields != panel.fields:
+            panel = panel.select_fields(fields)
+
+        values = panel.values
+        values[np.isnan(values)] = 0
+
+        df = DataMatrix.from_panel(panel, name = self.name, universe = self.universe, timeframe = cm.TimeFrame.DAILY)
+        df._indicator_cache = cache
+        df._sources = sources
+        return df
 
-        for ticker in self.universe[1:]:
-            tdf = Stock(self, ticker).get_daily_hist_price(self.start_date,
-                                                        self.end_date).grab_fields(fields)
-            for col in tdf.columns:
-                df[col] = tdf[col]
+    @staticmethod
+    def get_trading_calendar(dates_list):
+        '''
+        return the sorted union of a list of datetime64 date arrays
+        '''
+        if len(dates_list) == 0:
+            return np.array([], dtype = 'datetime64[D]')
+        return np.unique(np.concatenate(dates_list))
 
-        df = DataMatrix(df, name = self.name, universe = self.universe, timeframe = cm.TimeFrame.DAILY)
-        df.fillna(0, inplace=True)
 
-        return df
+def _attach_datamatrix(descriptor, name, universe, timeframe, indicator_cache, sources):
+    '''
+    rebuild a read-only DataMatrix on the shared memory published by DataMatrix.share()
+    '''
+    dm = DataMatrix.from_panel(SharedPanel.attach(descriptor), name = name, universe = universe, timeframe = timeframe)
+    dm._indicator_cache = indicator_cache
+    dm._sources = sources
+    return dm
+
+def share_with_workers(dms):
+    '''
+    publish the DataMatrix objects in shared memory unless worker processes are forked, since a forked
+    process shares the memory of its parent already. Return the owners of the shared memory
+    '''
+    if multiprocessing.get_start_method() == 'fork':
+        return []
+    unique = {id(dm): dm for dm in dms}
+    return [dm.share() for dm in unique.values()]
+
+def _load_ticker_block(loader, fields, ticker):
+    '''
+    load the raw fields of one ticker and return its dates, its numeric fields and a fields x dates array of
+    their values. It is a module level function so that it can be sent to a process pool,
+    and a numpy array is much cheaper to send back than a DataFrame
+    '''
+    tdf = loader.get_daily_hist_price(ticker, loader.start_date, loader.end_date, fields)
+    tdf = tdf.select_dtypes(include = 'number')
+
+    dates = pd.DatetimeIndex(tdf.index).values.astype('datetime64[D]')
+    return (dates, list(tdf.columns), tdf.to_numpy(dtype = float).T)
 
 # ==============================================
 # Testing
@@ -193,9 +470,46 @@ def _test2():
 
     print(dm2.head(), type(dm2))
 
+def _test3():
+    '''
+    the indicators of the DataMatrix match those of Stock, calculated on the dates of each ticker,
+    on synthetic data where the tickers miss some dates the others have
+    '''
+    import tempfile
+    from synthetic import SyntheticMarket
+    from stock import Stock
+
+    print('Running test3')
+    tmp_dir = tempfile.mkdtemp()
+    start_date = datetime.date(2015, 1, 1)
+    end_date = datetime.date(2020, 1, 1)
+    market = SyntheticMarket(20, start_date, end_date, seed = 1, gap_rate = 0.02, halt_rate = 1.0)
+    market.write(os.path.join(tmp_dir, 'data'), os.path.join(tmp_dir, 'meta'), 'Gapped Universe')
+
+    pref = Preference()
+    pref.use_cache = False
+    pref.data_dir = os.path.join(tmp_dir, 'data')
+    loader = DataMatrixLoader(pref, 'gapped', market.tickers, start_date, end_date)
+    dm = loader.get_daily_datamatrix()
+
+    fields = ['SMA_200', 'RSI', 'daily_returns', 'RSI_20']
+    for fld in fields:
+        # RSI_20 is not a default field, it is calculated by the DataMatrix on first access
+        panel_values = pd.DataFrame(dm.field(fld), index = pd.DatetimeIndex(dm.index), columns = dm.panel.tickers)
+        max_diff = 0.0
+        for ticker in market.tickers:
+            stock = Stock(loader, ticker).get_daily_hist_price(start_date, end_date, [fld])
+            expected = stock.ohlcv_df[fld].fillna(0).to_numpy()
+            actual = panel_values[ticker].loc[pd.DatetimeIndex(stock.ohlcv_df.index)].to_numpy()
+            if not np.allclose(actual, expected, rtol = 1e-9, atol = 1e-9):
+                raise Exception(f"{fld} of {ticker} differs from Stock by up to {np.abs(actual - expected).max()}")
+            max_diff = max(max_diff, np.abs(actual - expected).max())
+        print(f"{fld}: same as Stock for {len(market.tickers)} tickers, max difference {max_diff:.3g}")
+
 def _test():
     _test1()
     _test2()
+    _test3()
 
 if __name__ == "__main__":
     import sys
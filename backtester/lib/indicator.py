@@ -0,0 +1,369 @@
+'''
+Registry of derived fields such as moving averages, returns and technical indicators
+'''
+
+import re
+import types
+import hashlib
+import numpy as np
+import pandas as pd
+
+import common as cm
+
+
+class Indicator(object):
+
+    '''
+    A derived field, matched by a regular expression on the field name.
+    The groups of the match are passed as parameters to the calculation,
+    after the input fields. The inputs can themselves be derived fields.
+    '''
+
+    def __init__(self, pattern, inputs, func):
+        self.pattern = re.compile(pattern)
+        self.inputs = inputs
+        self.func = func
+        self._fingerprint = None
+
+    def match(self, fld):
+        return self.pattern.fullmatch(fld)
+
+    def get_fingerprint(self):
+        '''
+        digest of the pattern, the inputs and the code of the calculation, including the functions
+        of this module that it calls, so that a change to any of them gives a new fingerprint
+        '''
+        if self._fingerprint is None:
+            digest = hashlib.sha1(f"{self.pattern.pattern}|{'|'.join(self.inputs)}|".encode('utf-8'))
+            seen = set()
+            _update_code_digest(digest, self.func.__code__, seen)
+            # how the dates x tickers arrays are passed to the calculation
+            _update_code_digest(digest, calculate.__code__, seen)
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+
+def _update_code_digest(digest, code, seen):
+    '''
+    add the bytecode and constants of code to digest, then those of the nested code objects
+    and of the functions of this module it refers to by name
+    '''
+    if code in seen:
+        return
+    seen.add(code)
+    digest.update(code.co_code)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_digest(digest, const, seen)
+        elif isinstance(const, frozenset):
+            # the order of a set changes with the string hash seed of the process
+            digest.update(repr(sorted(const, key = repr)).encode('utf-8'))
+        else:
+            digest.update(repr(const).encode('utf-8'))
+    for name in code.co_names:
+        obj = globals().get(name)
+        if isinstance(obj, types.FunctionType) and obj.__module__ == __name__:
+            digest.update(name.encode('utf-8'))
+            _update_code_digest(digest, obj.__code__, seen)
+
+
+_registry = []
+
+def register(pattern, inputs):
+    '''
+    decorator adding a calculation to the registry, the function takes the input fields
+    as dates x tickers arrays followed by the parameters in the name.
+    Each ticker is calculated on its own, the cache relies on it to calculate only some of the tickers
+    '''
+    def decorator(func):
+        _registry.append(Indicator(pattern, inputs, func))
+        return func
+    return decorator
+
+def find_indicator(fld):
+    '''
+    return (indicator, parameters) for a derived field name, None otherwise
+    '''
+    for ind in _registry:
+        m = ind.match(str(fld))
+        if m is not None:
+            return (ind, m.groups())
+    return None
+
+def is_derived(fld):
+    return find_indicator(fld) is not None
+
+def get_inputs(fld):
+    ind, _ = find_indicator(fld)
+    return list(ind.inputs)
+
+def get_raw_inputs(fields):
+    '''
+    return the fields that must be loaded from the data files to calculate fields
+    '''
+    result = []
+    for fld in fields:
+        fld = str(fld)
+        if is_derived(fld):
+            inputs = get_raw_inputs(get_inputs(fld))
+        else:
+            inputs = [fld]
+        result += [x for x in inputs if x not in result]
+    return result
+
+def get_default_fields():
+    '''
+    derived fields calculated when the caller does not ask for specific fields
+    '''
+    return cm.SMA_Fields_value + [cm.DataField.daily_returns.value, cm.DataField.weekly_returns.value,
+                                  cm.DataField.monthly_returns.value, cm.DataField.RSI.value]
+
+def get_fingerprint(fld):
+    '''
+    fingerprint of the calculation of a derived field, including the calculation of its derived inputs
+    '''
+    ind, _ = find_indicator(fld)
+    return '|'.join([ind.get_fingerprint()] + [get_fingerprint(name) for name in ind.inputs if is_derived(name)])
+
+def calculate(fld, get_input):
+    '''
+    calculate a derived field, get_input(name) returns the values of an input field, either
+    a 1-D array for one ticker or a dates x tickers array. NaN values are treated as missing.
+    In a dates x tickers array, the dates of a ticker are those where its raw inputs have a value,
+    a ticker with missing dates in between is calculated on its own dates as for a 1-D array
+    '''
+    ind, params = find_indicator(fld)
+    inputs = [np.asarray(get_input(name), dtype = float) for name in ind.inputs]
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        if inputs[0].ndim == 1:
+            return ind.func(*[x[:, None] for x in inputs], *params)[:, 0]
+
+        present = np.logical_and.reduce([~np.isnan(np.asarray(get_input(name), dtype = float))
+                                         for name in get_raw_inputs([fld])])
+        gapped = _get_gapped_columns(present)
+        if len(gapped) == 0:
+            return ind.func(*inputs, *params)
+
+        result = np.empty(inputs[0].shape)
+        others = np.setdiff1d(np.arange(inputs[0].shape[1]), gapped)
+        if len(others) > 0:
+            result[:, others] = ind.func(*[x[:, others] for x in inputs], *params)
+
+        # move the dates of each gapped ticker to the top of its column, calculate, then put the values back
+        present = present[:, gapped]
+        order = np.argsort(~present, axis = 0, kind = 'stable')
+        values = ind.func(*[np.take_along_axis(x[:, gapped], order, axis = 0) for x in inputs], *params)
+        scattered = np.empty(values.shape)
+        np.put_along_axis(scattered, order, values, axis = 0)
+        scattered[~present] = np.nan
+        result[:, gapped] = scattered
+        return result
+
+def _get_gapped_columns(present):
+    '''
+    columns of a dates x tickers mask with a missing date between their first and last dates
+    '''
+    count = present.sum(axis = 0)
+    first = present.argmax(axis = 0)
+    last = len(present) - 1 - present[::-1].argmax(axis = 0)
+    return np.flatnonzero((count > 0) & (last - first + 1 != count))
+
+def calculate_cached(fld, get_input, cache, dates, tickers, sources):
+    '''
+    same as calculate, going through the indicator cache when there is one. sources are the fingerprints
+    of the input data, one per ticker: only the tickers whose source has changed are calculated again.
+    The key also carries the fingerprint of the calculation, so an entry is not used once the code of the indicator
+    has changed. The inputs are only requested on a miss, so a warm run does no calculation
+    '''
+    if cache is None or sources is None:
+        return calculate(fld, get_input)
+
+    def calculate_columns(columns):
+        if columns is None:
+            return calculate(fld, get_input)
+        # the tickers are calculated independently of each other
+        return calculate(fld, lambda name: get_input(name)[:, columns])
+
+    key = cache.get_key(str(fld), dates, tickers, get_fingerprint(fld))
+    return cache.get(key, sources, calculate_columns)
+
+
+
+# ==============================================
+# Vectorized calculations along the dates axis (axis 0) of a dates x tickers array
+# ==============================================
+def shift(x, periods):
+    '''
+    same as DataFrame.shift(periods) for periods >= 0
+    '''
+    result = np.full_like(x, np.nan)
+    if periods < len(x):
+        result[periods:] = x[:len(x) - periods]
+    return result
+
+def linear_filter(u, decay):
+    '''
+    solve y[t] = decay * y[t-1] + u[t] with y[-1] = 0.
+    The recursion has the closed form y[t] = decay**t * cumsum(u[i] * decay**-i), which is evaluated
+    in blocks short enough for decay**-i not to overflow, carrying y from one block to the next
+    '''
+    if decay == 0:
+        return u.copy()
+
+    y = np.empty_like(u)
+    block = max(1, int(300 / -np.log(decay)))
+    carry = np.zeros(u.shape[1:])
+    for start in range(0, len(u), block):
+        k = np.arange(min(block, len(u) - start))[:, None]
+        y[start:start + len(k)] = decay ** k * (decay * carry + np.cumsum(u[start:start + len(k)] * decay ** -k, axis = 0))
+        carry = y[start + len(k) - 1]
+    return y
+
+def rolling_mean(x, period):
+    '''
+    same as rolling(period).mean(), a window with a missing value is NaN
+    '''
+    result = np.full_like(x, np.nan)
+    if len(x) < period:
+        return result
+
+    valid = ~np.isnan(x)
+    total = np.cumsum(np.where(valid, x, 0), axis = 0)
+    count = np.cumsum(valid, axis = 0)
+
+    window_total = total[period - 1:].copy()
+    window_total[1:] -= total[:len(x) - period]
+    window_count = count[period - 1:].copy()
+    window_count[1:] -= count[:len(x) - period]
+
+    result[period - 1:] = np.where(window_count == period, window_total / period, np.nan)
+    return result
+
+def rolling_extremum(x, period, func):
+    '''
+    same as rolling(period).max() for func = np.maximum (rolling(period).min() for np.minimum).
+    Uses the van Herk/Gil-Werman method: the running extremum within blocks of size period, forwards and
+    backwards, combine into the extremum of any window with two lookups.
+    '''
+    result = np.full_like(x, np.nan)
+    if len(x) < period:
+        return result
+
+    valid = ~np.isnan(x)
+    fill = -np.inf if func is np.maximum else np.inf
+    pad = (-len(x)) % period
+    padded = np.concatenate([np.where(valid, x, fill), np.full((pad,) + x.shape[1:], fill)])
+
+    blocks = padded.reshape((-1, period) + x.shape[1:])
+    forward = func.accumulate(blocks, axis = 1).reshape(padded.shape)
+    backward = func.accumulate(blocks[:, ::-1], axis = 1)[:, ::-1].reshape(padded.shape)
+
+    count = rolling_mean(valid.astype(float), period)
+    result[period - 1:] = func(backward[:len(x) - period + 1], forward[period - 1:len(x)])
+    result[count != 1] = np.nan
+    return result
+
+def ewm_mean(x, alpha, min_periods):
+    '''
+    same as ewm(alpha = alpha, min_periods = min_periods).mean() (adjust = True).
+    The weighted sum and the sum of weights are both linear filters, a missing value
+    adds nothing but still decays the earlier observations
+    '''
+    valid = ~np.isnan(x)
+    numerator = linear_filter(np.where(valid, x, 0), 1 - alpha)
+    denominator = linear_filter(valid.astype(float), 1 - alpha)
+
+    result = numerator / denominator
+    result[np.cumsum(valid, axis = 0) < min_periods] = np.nan
+    return result
+
+def ema(x, period):
+    '''
+    same as pandas_ta ema: seeded with the simple average of the first period values,
+    then y[t] = (1 - alpha) * y[t-1] + alpha * x[t] with alpha = 2 / (period + 1).
+    Each column starts at its own first valid value, the average carries over missing values
+    '''
+    alpha = 2.0 / (period + 1)
+    valid = ~np.isnan(x)
+    first = np.where(valid.any(axis = 0), valid.argmax(axis = 0), len(x))
+    seed_pos = first + period - 1
+
+    rows = np.arange(len(x))[:, None]
+    x = pd.DataFrame(x).ffill().to_numpy()
+    seed = rolling_mean(x, period)
+
+    u = np.where(rows > seed_pos, alpha * x, 0)
+    has_seed = seed_pos < len(x)
+    cols = np.flatnonzero(has_seed)
+    u[seed_pos[cols], cols] = seed[seed_pos[cols], cols]
+
+    result = linear_filter(np.nan_to_num(u), 1 - alpha)
+    result[(rows < seed_pos) | ~valid] = np.nan
+    return result
+
+def rsi(x, period):
+    '''
+    same as pandas_ta rsi: the gains and losses are smoothed with Wilder moving average (alpha = 1 / period)
+    '''
+    change = x - shift(x, 1)
+    gain = np.where(change < 0, 0, change)
+    loss = np.where(change > 0, 0, change)
+
+    avg_gain = ewm_mean(gain, 1.0 / period, period)
+    avg_loss = ewm_mean(loss, 1.0 / period, period)
+    return 100 * avg_gain / (avg_gain + np.abs(avg_loss))
+
+
+@register(r'SMA_(\d+)', [cm.DataField.close.value])
+def _sma(close, period):
+    return rolling_mean(close, int(period))
+
+@register(r'EMA_(\d+)', [cm.DataField.close.value])
+def _ema(close, period):
+    return ema(close, int(period))
+
+@register(r'RSI', [cm.DataField.close.value])
+def _rsi_default(close):
+    std_rsi_period = 14
+    return rsi(close, std_rsi_period)
+
+@register(r'RSI_(\d+)', [cm.DataField.close.value])
+def _rsi(close, period):
+    return rsi(close, int(period))
+
+@register(r'daily_returns', [cm.DataField.close.value])
+def _daily_returns(close):
+    return (close - shift(close, 1))/shift(close, 1)
+
+@register(r'weekly_returns', [cm.DataField.close.value])
+def _weekly_returns(close):
+    return (close - shift(close, 5))/shift(close, 1)
+
+@register(r'monthly_returns', [cm.DataField.close.value])
+def _monthly_returns(close):
+    return (close - shift(close, 20))/shift(close, 1)
+
+@register(r'52_weeks_high', [cm.DataField.high.value])
+def _fifty_two_high(high):
+    return rolling_extremum(high, 252, np.maximum)
+
+@register(r'52_weeks_low', [cm.DataField.low.value])
+def _fifty_two_low(low):
+    return rolling_extremum(low, 252, np.minimum)
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    for fld in ['SMA_10', 'SMA_200', 'RSI', 'RSI_20', '52_weeks_high', 'Close', 'Volume']:
+        print(fld, is_derived(fld), get_raw_inputs([fld]))
+
+    close = np.array([10.0, 11.0, 10.5, 12.0, 12.5, 13.0])
+    print(calculate('SMA_3', lambda name: close))
+    print(calculate('EMA_3', lambda name: close))
+    print(calculate('daily_returns', lambda name: close))
+
+if __name__ == '__main__':
+    _test()
@@ -3,6 +3,7 @@ Classes for loading data into DataFrame
 '''
 
 import os
+import io
 import datetime
 import enum
 import pandas as pd
@@ -10,6 +11,7 @@ import numpy as np
 
 import common as cm
 
+from cache import PriceCache, IndicatorCache
 from preference import Preference
 
 class DataLoader(object):
@@ -28,27 +30,127 @@ class DataLoader(object):
         self.data_src = data_src
         self.db_connection = db_connection
         if data_dir is None:
-            self.data_dir = self.pref.train_data_dir
+            # --data_dir, e.g. a directory of synthetic data, replaces the train data
+            self.data_dir = self.pref.train_data_dir if self.pref.data_dir is None else self.pref.data_dir
         else:
             self.data_dir = data_dir
 
+        if self.pref.use_cache:
+            self.cache = PriceCache(self.pref.cache_dir)
+            self.indicator_cache = IndicatorCache(os.path.join(self.pref.cache_dir, 'indicators'),
+                                                  self.pref.indicator_cache_size * 1024 * 1024)
+        else:
+            self.cache = None
+            self.indicator_cache = None
 
-    def get_daily_hist_price(self, ticker, start_date = None, end_date = None):
-
+    def get_source_fname(self, ticker):
         fname = os.path.join(self.data_dir, f"{ticker}_daily.csv")
         if not os.path.exists(fname):
             fname = os.path.join(self.data_dir, f"{ticker}.csv")
-        df = pd.read_csv(fname)
+        return(fname)
+
+    def get_source_key(self, ticker):
+        '''
+        fingerprint of the price data of ticker, it changes whenever the source file is modified
+        '''
+        fname = os.path.abspath(self.get_source_fname(ticker))
+        st = os.stat(fname)
+        return(f"{ticker}:{fname}:{st.st_size}:{st.st_mtime_ns}")
+
+
+    def get_daily_hist_price(self, ticker, start_date = None, end_date = None, fields = None):
+        '''
+        load the daily price of ticker between start_date and end_date (inclusive).
+        fields restricts the columns being returned, fields not found in the file are ignored
+        '''
+        fname = self.get_source_fname(ticker)
+
+        if fields is None:
+            usecols = lambda col: col != 'Date'
+        else:
+            names = set(str(fld) for fld in fields)
+            usecols = lambda col: col in names and col != 'Date'
 
-        df['Date'] = df['Date'].apply(lambda x: datetime.datetime.strptime(x[:10], '%Y-%m-%d').date())
+        if self.cache is None:
+            dates, columns = self._read_daily_csv(fname, start_date, end_date, usecols)
+        else:
+            fingerprint = self.cache.get_fingerprint(fname)
+            entry = self.cache.load(fname, fingerprint)
+            if entry is None:
+                entry = self._read_daily_csv(fname)
+                self.cache.save(fname, fingerprint, *entry)
+
+            dates, columns = entry
+            lo, hi = self._get_date_window(dates, start_date, end_date)
+            dates = dates[lo:hi]
+            columns = {col: values[lo:hi] for col, values in columns.items() if usecols(col)}
+
+        index = pd.Index(dates.astype(object), name = 'Date')
+        df = pd.DataFrame(columns, index = index)
+        return(df)
 
+    @staticmethod
+    def _get_date_window(dates, start_date, end_date):
+        '''
+        dates are sorted, so the date range is a contiguous slice [lo, hi)
+        '''
+        lo, hi = 0, len(dates)
         if start_date is not None:
-            df = df[df['Date'] >= start_date]
+            lo = np.searchsorted(dates, np.datetime64(start_date, 'D'), side = 'left')
         if end_date is not None:
-            df = df[df['Date'] <= end_date]
+            hi = np.searchsorted(dates, np.datetime64(end_date, 'D'), side = 'right')
+        return(lo, hi)
+
+    def _read_daily_csv(self, fname, start_date = None, end_date = None, usecols = None):
+        '''
+        parse a daily price csv file into a sorted datetime64 array of dates and a dict of column arrays.
+        The dates are parsed in one pass from the first 10 characters of every line (YYYY-MM-DD, the time and
+        timezone suffix are ignored), and only the lines within the date range are handed to the csv parser.
+        '''
+        with open(fname, 'rb') as fin:
+            buf = fin.read()
+        # every line ends with a newline, including a header without any row
+        if not buf.endswith(b'\n'):
+            buf += b'\n'
+
+        raw = np.frombuffer(buf, dtype = np.uint8)
+        line_starts = np.flatnonzero(raw == ord('\n')) + 1
+        header = buf[:line_starts[0]]
+        line_starts = line_starts[line_starts + 10 <= len(buf)]
+        # the csv parser skips the blank lines, so do the dates
+        line_starts = line_starts[(raw[line_starts] != ord('\n')) & (raw[line_starts] != ord('\r'))]
+
+        dates = raw[line_starts[:, None] + np.arange(10)].view('S10').ravel().astype('datetime64[D]')
+        line_ends = np.append(line_starts[1:], len(buf))
+
+        if np.all(dates[1:] >= dates[:-1]):
+            lo, hi = self._get_date_window(dates, start_date, end_date)
+            order = None
+        else:
+            lo, hi = 0, len(dates)
+            order = np.argsort(dates, kind = 'stable')
 
-        df = df.set_index('Date')
-        return(df)
+        if usecols is None:
+            usecols = lambda col: col != 'Date'
+
+        # an empty window still parses the first line so that the columns keep their dtypes
+        first, last = (lo, hi) if hi > lo else (0, min(1, len(dates)))
+        body = buf[line_starts[first]:line_ends[last - 1]] if last > first else b''
+        df = pd.read_csv(io.BytesIO(header + body), usecols = usecols)
+        if len(df) != last - first:
+            raise Exception(f"Unexpected number of rows in {fname}, found {len(df)} instead of {last - first}")
+
+        columns = {col: df[col].to_numpy()[:hi - lo] for col in df.columns}
+        dates = dates[lo:hi]
+
+        if order is not None:
+            columns = {col: values[order] for col, values in columns.items()}
+            dates = dates[order]
+            lo, hi = self._get_date_window(dates, start_date, end_date)
+            columns = {col: values[lo:hi] for col, values in columns.items()}
+            dates = dates[lo:hi]
+
+        return(dates, columns)
 
 
 def _test1():
@@ -64,11 +166,33 @@ def _test1():
     print(df.head())
     print(df.tail())
 
+# ==============================================
+# Testing
+# ==============================================
+def _test2():
+    '''
+    files with blank lines, without a trailing newline or without any row
+    '''
+    import tempfile
+    print('Running test2')
+    loader = DataLoader(Preference())
+    header = 'Date,Open,Close,Ticker\n'
+    rows = ['2020-01-02 00:00:00-05:00,1.0,1.5,AAA\n', '2020-01-03 00:00:00-05:00,2.0,2.5,AAA\n']
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in [('blank', header + rows[0] + '\n' + rows[1] + '\n'), ('no_newline', header + rows[0] + rows[1][:-1]),
+                           ('header', header[:-1]), ('crlf', (header + rows[0] + '\n' + rows[1]).replace('\n', '\r\n'))]:
+            fname = os.path.join(tmp, f"{name}.csv")
+            with open(fname, 'w', newline = '') as f:
+                f.write(text)
+            dates, columns = loader._read_daily_csv(fname)
+            print(name, dates, {col: values.tolist() for col, values in columns.items()})
+
 # ==============================================
 # Testing
 # ==============================================
 def _test():
     _test1()
+    _test2()
 
 
 if __name__ == '__main__':
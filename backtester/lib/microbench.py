@@ -0,0 +1,298 @@
+'''
+Microbenchmarks of the hot paths of the backtester
+'''
+
+import os
+import re
+import gc
+import json
+import time
+import platform
+import datetime
+import statistics
+import tempfile
+import numpy as np
+import pandas as pd
+
+import common as cm
+from loader import DataLoader
+from datamatrix import DataMatrixLoader
+from stock import Stock
+from strategy import Strategy
+from portfolio import Portfolio
+
+
+class Microbenchmark(object):
+
+    '''
+    A function timed on a scale (a number of tickers and of years).
+    setup(context, tickers, start_date, end_date) returns (run, state) outside of the timing, run(state) is what
+    is timed. prepare(state) runs before each repetition, also outside of the timing
+    '''
+
+    def __init__(self, name, setup, prepare = None):
+        self.name = name
+        self.setup = setup
+        self.prepare = prepare
+
+
+_registry = []
+
+def register(name, prepare = None):
+    '''
+    decorator adding a benchmark setup to the registry
+    '''
+    def decorator(setup):
+        _registry.append(Microbenchmark(name, setup, prepare))
+        return setup
+    return decorator
+
+def get_benchmarks(pattern = None):
+    return [bench for bench in _registry if pattern is None or re.search(pattern, bench.name)]
+
+
+class BenchmarkContext(object):
+
+    '''
+    What the benchmarks share: the preference, the tickers available in the data directory
+    and the date range of the data. DataMatrix objects are kept between the benchmarks of a scale
+    '''
+
+    def __init__(self, pref, data_dir = None):
+        self.pref = pref
+        self.loader = DataLoader(pref, data_dir = data_dir)
+        self.data_dir = self.loader.data_dir
+        self.tickers = sorted(fname[:-len('.csv')].replace('_daily', '') for fname in os.listdir(self.data_dir)
+                              if fname.endswith('.csv'))
+        self._datamatrix = {}
+        self._first_last = {}
+
+    def get_date_range(self, tickers):
+        '''
+        earliest and latest dates among the data files of tickers, from their first and last lines
+        '''
+        first, last = None, None
+        for ticker in tickers:
+            if ticker not in self._first_last:
+                with open(self.loader.get_source_fname(ticker), 'rb') as fin:
+                    fin.readline()
+                    head = fin.readline()[:10]
+                    fin.seek(max(0, os.path.getsize(fin.name) - 4096))
+                    tail = fin.read().rstrip(b'\n').split(b'\n')[-1][:10]
+                self._first_last[ticker] = (np.datetime64(head.decode(), 'D'), np.datetime64(tail.decode(), 'D'))
+            lo, hi = self._first_last[ticker]
+            first = lo if first is None else min(first, lo)
+            last = hi if last is None else max(last, hi)
+        return (first, last)
+
+    def get_scale(self, num_tickers, num_years):
+        '''
+        return (tickers, start_date, end_date) for a scale, None when the data is not large enough
+        '''
+        if num_tickers > len(self.tickers):
+            return None
+        tickers = self.tickers[:num_tickers]
+        first, last = self.get_date_range(tickers)
+        span = (last - first).astype(int) / 365.25
+        if num_years > round(span):
+            return None
+        end_date = last.astype(datetime.date)
+        start_date = max(first, last - int(num_years * 365.25)).astype(datetime.date)
+        return (tickers, start_date, end_date)
+
+    def get_datamatrix(self, tickers, start_date, end_date):
+        key = (len(tickers), start_date, end_date)
+        if key not in self._datamatrix:
+            self._datamatrix.clear()
+            loader = DataMatrixLoader(self.pref, 'microbench', tickers, start_date, end_date, data_dir = self.data_dir)
+            self._datamatrix[key] = loader.get_daily_datamatrix()
+        return self._datamatrix[key]
+
+
+# ==============================================
+# Benchmarks
+# ==============================================
+@register('DataLoader.get_daily_hist_price')
+def _bench_load(context, tickers, start_date, end_date):
+    loader = context.loader
+    def run(tickers):
+        for ticker in tickers:
+            loader.get_daily_hist_price(ticker, start_date, end_date)
+    return (run, tickers)
+
+@register('DataMatrixLoader.get_daily_datamatrix')
+def _bench_datamatrix(context, tickers, start_date, end_date):
+    loader = DataMatrixLoader(context.pref, 'microbench', tickers, start_date, end_date, data_dir = context.data_dir)
+    return (lambda loader: loader.get_daily_datamatrix(), loader)
+
+def _reset_stocks(state):
+    stocks, raw = state
+    for stock, df in zip(stocks, raw):
+        stock.ohlcv_df = df.copy()
+
+@register('Stock._calc_daily_basic', prepare = _reset_stocks)
+def _bench_calc_daily_basic(context, tickers, start_date, end_date):
+    # calculate the indicators, not read them from the indicator cache
+    loader = DataLoader(context.pref, data_dir = context.data_dir)
+    loader.indicator_cache = None
+    stocks = [Stock(loader, ticker) for ticker in tickers]
+    raw = [loader.get_daily_hist_price(ticker, start_date, end_date) for ticker in tickers]
+    def run(state):
+        for stock in state[0]:
+            stock._calc_daily_basic()
+    return (run, (stocks, raw))
+
+class _FixedOrders(Strategy):
+    '''
+    strategy replaying a given OrderList, so that run_strategy is timed without any model
+    '''
+    def __init__(self, pref, input_datamatrix, initial_capital, orders):
+        super().__init__(pref, 'FixedOrders', input_datamatrix, initial_capital)
+        self.fixed_orders = orders
+
+    def run_model(self, model = None):
+        return self.fixed_orders
+
+def _get_rsi(context, tickers, start_date, end_date):
+    from RSI_strategy import RSIStrategy
+    dm = context.get_datamatrix(tickers, start_date, end_date)
+    return RSIStrategy(context.pref, dm, cm.OneMillion)
+
+@register('RSIStrategy.run_model')
+def _bench_run_model(context, tickers, start_date, end_date):
+    return (lambda rsi: rsi.run_model(), _get_rsi(context, tickers, start_date, end_date))
+
+@register('Strategy.run_strategy')
+def _bench_run_strategy(context, tickers, start_date, end_date):
+    rsi = _get_rsi(context, tickers, start_date, end_date)
+    strategy = _FixedOrders(context.pref, rsi.input_dm, cm.OneMillion, rsi.run_model())
+    return (lambda strategy: strategy.run_strategy(), strategy)
+
+def _get_trades(context, tickers, start_date, end_date):
+    '''
+    the trades of the RSI strategy, as arguments of Portfolio.add_trade
+    '''
+    rsi = _get_rsi(context, tickers, start_date, end_date)
+    rsi.run_strategy()
+    orders = rsi.orders
+    prices = rsi.pricing_matrix.to_numpy()
+    trades = []
+    for k in np.flatnonzero(cm.is_buy(orders.actions) | cm.is_sell(orders.actions)):
+        i, j = orders.date_index[k], orders.ticker_index[k]
+        trades.append((rsi.pricing_matrix.columns[j], cm.decode_trade_action(orders.actions[k]),
+                       rsi.pricing_matrix.index[i], prices[i, j], abs(orders.shares_with_sign[k])))
+    return trades
+
+@register('Portfolio.add_trade')
+def _bench_add_trade(context, tickers, start_date, end_date):
+    def run(trades):
+        port = Portfolio('microbench')
+        for trade in trades:
+            port.add_trade(*trade)
+    return (run, _get_trades(context, tickers, start_date, end_date))
+
+@register('Portfolio.save_trade_history')
+def _bench_save_trade_history(context, tickers, start_date, end_date):
+    port = Portfolio('microbench')
+    for trade in _get_trades(context, tickers, start_date, end_date):
+        port.add_trade(*trade)
+    fname = os.path.join(tempfile.gettempdir(), f"microbench_{os.getpid()}_trade_history.csv")
+    return (lambda port: port.save_trade_history(fname), port)
+
+
+# ==============================================
+# Running and comparing
+# ==============================================
+def time_benchmark(bench, run, state, repeat):
+    '''
+    time repeat runs after a warm up run, with the garbage collector off during each run as timeit does
+    '''
+    times = []
+    for k in range(repeat + 1):
+        if bench.prepare is not None:
+            bench.prepare(state)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(state)
+            elapsed = time.perf_counter() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if k > 0:
+            times.append(elapsed)
+    return times
+
+def run_benchmarks(pref, benchmarks, ticker_scales = (10, 100, 1000), year_scales = (1, 5, 20), repeat = 5,
+                   data_dir = None, verbose = True):
+    '''
+    run the benchmarks on every scale the data allows, return a dict with the environment and the results
+    '''
+    context = BenchmarkContext(pref, data_dir)
+    results = []
+    skipped = []
+    for num_tickers in ticker_scales:
+        for num_years in year_scales:
+            scale = context.get_scale(num_tickers, num_years)
+            if scale is None:
+                skipped.append(f"{num_tickers} tickers x {num_years} years")
+                continue
+
+            for bench in benchmarks:
+                run, state = bench.setup(context, *scale)
+                times = time_benchmark(bench, run, state, repeat)
+                result = {'name': bench.name, 'tickers': num_tickers, 'years': num_years, 'repeat': repeat,
+                          'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times),
+                          'stdev': statistics.stdev(times) if len(times) > 1 else 0.0}
+                results.append(result)
+                if verbose:
+                    print(f"{bench.name:40s} {num_tickers:>6d} tickers {num_years:>3d} years   "
+                          f"median {result['median']*1000:12.3f} ms   min {result['min']*1000:12.3f} ms")
+
+    if verbose and len(skipped) > 0:
+        print(f"Skipped (not enough data in {context.data_dir}): {', '.join(skipped)}")
+
+    return {'environment': get_environment(pref, context.data_dir), 'skipped': skipped, 'results': results}
+
+def get_environment(pref, data_dir):
+    return {'date': datetime.datetime.now().isoformat(timespec = 'seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'data_dir': data_dir, 'use_cache': pref.use_cache}
+
+def save_results(results, fname):
+    with open(fname, 'w') as f:
+        json.dump(results, f, indent = 2)
+
+def load_results(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+def compare_results(baseline, current, threshold = 0.1):
+    '''
+    return a DataFrame comparing the median time of the benchmarks found in both results.
+    ratio is current / baseline, status is slower (faster) when the ratio is above 1 + threshold (below 1 - threshold)
+    '''
+    keys = ['name', 'tickers', 'years']
+    base = pd.DataFrame(baseline['results'], columns = keys + ['median'])
+    curr = pd.DataFrame(current['results'], columns = keys + ['median'])
+    df = base.merge(curr, on = keys, suffixes = (' baseline', ' current'))
+
+    df['ratio'] = df['median current'] / df['median baseline']
+    df['status'] = np.where(df['ratio'] > 1 + threshold, 'slower', np.where(df['ratio'] < 1 - threshold, 'faster', ''))
+    return df
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    from preference import Preference
+
+    pref = Preference()
+    results = run_benchmarks(pref, get_benchmarks(), ticker_scales = (10,), year_scales = (1,), repeat = 3)
+    print(compare_results(results, results))
+
+if __name__ == '__main__':
+    _test()
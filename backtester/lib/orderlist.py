@@ -0,0 +1,126 @@
+'''
+Class to store the orders generated by a strategy
+'''
+
+import numpy as np
+import pandas as pd
+
+import common as cm
+
+
+class OrderList(object):
+
+    '''
+    Sparse output of a strategy, one row per order instead of dense dates x tickers matrices.
+    An order is given by the row of its date and the column of its ticker in the pricing matrix,
+    the signed shares (positive to buy, negative to sell) and the integer code of its TradeAction.
+    The orders are kept sorted by date, then by ticker.
+    '''
+
+    def __init__(self, date_index, ticker_index, shares_with_sign, actions):
+        date_index = np.asarray(date_index, dtype = np.int64)
+        ticker_index = np.asarray(ticker_index, dtype = np.int64)
+        shares_with_sign = np.asarray(shares_with_sign, dtype = float)
+        actions = cm.encode_trade_actions(actions)
+
+        if not len(date_index) == len(ticker_index) == len(shares_with_sign) == len(actions):
+            raise Exception(f"Expect order arrays of the same length, received {len(date_index)}, {len(ticker_index)}, "
+                            f"{len(shares_with_sign)} and {len(actions)}")
+
+        order = np.lexsort((ticker_index, date_index))
+        self.date_index = date_index[order]
+        self.ticker_index = ticker_index[order]
+        self.shares_with_sign = shares_with_sign[order]
+        self.actions = actions[order]
+
+    def __len__(self):
+        return len(self.date_index)
+
+    @classmethod
+    def from_dense(cls, tsignal, taction, shares):
+        '''
+        convert the dense output of a strategy. A cell is an order if it has a trade action
+        or if it changes the holding
+        '''
+        shares_with_sign = np.nan_to_num(shares.to_numpy(dtype = float) * tsignal.to_numpy(dtype = float))
+        date_index, ticker_index = np.nonzero(cm.get_trade_mask(taction) | (shares_with_sign != 0))
+        actions = taction.to_numpy()[date_index, ticker_index]
+        return cls(date_index, ticker_index, shares_with_sign[date_index, ticker_index], actions)
+
+    def validate(self, nrow, ncol):
+        if len(self) > 0:
+            if self.date_index.min() < 0 or self.date_index.max() >= nrow:
+                raise Exception(f"Order date index out of range [0, {nrow})")
+            if self.ticker_index.min() < 0 or self.ticker_index.max() >= ncol:
+                raise Exception(f"Order ticker index out of range [0, {ncol})")
+
+    def get_trade_amount(self, pricing):
+        '''
+        dollar amount paid for each order, pricing is the dates x tickers price array
+        '''
+        return self.shares_with_sign * pricing[self.date_index, self.ticker_index]
+
+    def get_trades_by_ticker(self):
+        '''
+        list of (ticker index, positions of its orders with a trade action, in date order)
+        '''
+        rows = np.flatnonzero(cm.is_buy(self.actions) | cm.is_sell(self.actions))
+        rows = rows[np.argsort(self.ticker_index[rows], kind = 'stable')]
+        groups = np.split(rows, np.flatnonzero(np.diff(self.ticker_index[rows])) + 1)
+        return [(self.ticker_index[group[0]], group) for group in groups if len(group) > 0]
+
+    def get_holding(self, nrow, ncol):
+        '''
+        dates x tickers array of the shares held after the orders of each period
+        '''
+        holding = np.zeros((nrow, ncol))
+        np.add.at(holding, (self.date_index, self.ticker_index), self.shares_with_sign)
+        return np.cumsum(holding, axis = 0)
+
+    def to_dense(self, index, columns):
+        '''
+        return the (tsignal, taction, shares) DataFrames of the dense strategy output, taction holds the codes
+        '''
+        nrow, ncol = len(index), len(columns)
+        tsignal = np.zeros((nrow, ncol))
+        shares = np.zeros((nrow, ncol))
+        taction = np.full((nrow, ncol), cm.TradeAction.NONE.code, dtype = np.int8)
+
+        tsignal[self.date_index, self.ticker_index] = np.sign(self.shares_with_sign)
+        shares[self.date_index, self.ticker_index] = np.abs(self.shares_with_sign)
+        taction[self.date_index, self.ticker_index] = self.actions
+
+        return (pd.DataFrame(tsignal, index = index, columns = columns),
+                pd.DataFrame(taction, index = index, columns = columns),
+                pd.DataFrame(shares, index = index, columns = columns))
+
+    def to_frame(self, index, columns):
+        '''
+        one row per order with the date, the ticker and the trade action decoded
+        '''
+        return pd.DataFrame({'Date': np.asarray(index, dtype = object)[self.date_index],
+                             'Ticker': np.asarray(columns, dtype = object)[self.ticker_index],
+                             'Action': cm.decode_trade_actions(self.actions),
+                             'Shares With Sign': self.shares_with_sign})
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    index = pd.Index(pd.date_range('2020-01-01', periods = 4).date, name = 'Date')
+    columns = ['AAA', 'BBB']
+
+    orders = OrderList([3, 0, 1], [0, 1, 1], [-100, 50, -50], [cm.TradeAction.SELL_TO_CLOSE_ALL, cm.TradeAction.BUY, 'SELL'])
+    print(orders.to_frame(index, columns))
+    print(orders.get_holding(len(index), len(columns)))
+    print(orders.get_trades_by_ticker())
+
+    tsignal, taction, shares = orders.to_dense(index, columns)
+    print(taction.dtypes.iloc[0], cm.decode_trade_actions(taction.to_numpy()))
+
+    dense = OrderList.from_dense(tsignal, taction, shares)
+    print(dense.to_frame(index, columns))
+
+if __name__ == '__main__':
+    _test()
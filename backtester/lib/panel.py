@@ -0,0 +1,246 @@
+'''
+Class to store numeric data for a list of tickers as a 3-D numpy array
+'''
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+class Panel(object):
+
+    '''
+    Panel stores float values indexed by (field, ticker, date) in one contiguous numpy array.
+
+    With this layout
+    1. the values of one field are a contiguous tickers x dates block, so field() returns
+       the dates x tickers matrix as a transposed view without copying
+    2. the whole panel can be viewed as a 2-D (field x ticker) x dates array, which is the
+       {ticker}_{field} column layout used by DataMatrix, again without copying
+
+    Spare capacity is kept along the field axis so that adding derived fields does not
+    reallocate the array every time.
+
+    A panel on values it does not own, e.g. attached to shared memory or sliced from another panel,
+    is fixed: its fields are never reallocated, the fields added afterwards are kept aside in a
+    dict of the process, which field() and series() consult. They are not part of values and get_columns()
+    '''
+
+    def __init__(self, dates, tickers, fields, values = None):
+        self.dates = np.asarray(dates, dtype = 'datetime64[D]')
+        self.tickers = list(tickers)
+        self.fields = [str(fld) for fld in fields]
+        self._ticker_index = {ticker: j for j, ticker in enumerate(self.tickers)}
+        self._field_index = {fld: k for k, fld in enumerate(self.fields)}
+        # tickers x dates arrays of the fields added to a fixed panel
+        self._aside = {}
+
+        shape = (len(self.fields), len(self.tickers), len(self.dates))
+        if values is None:
+            self._data = np.full(shape, np.nan)
+        else:
+            if values.shape != shape:
+                raise Exception(f"Expect panel values of shape {shape}, received {values.shape} instead")
+            self._data = values
+
+    @property
+    def values(self):
+        '''
+        (field, ticker, date) array of all the fields
+        '''
+        return self._data[:len(self.fields)]
+
+    @property
+    def shape(self):
+        return (len(self.dates), len(self.tickers), len(self.fields))
+
+    @property
+    def fixed(self):
+        '''
+        True when the values are read-only or a view of memory the panel does not own
+        '''
+        return not self._data.flags.writeable or not self._data.flags.owndata
+
+    @property
+    def aside_fields(self):
+        '''
+        the fields added to a fixed panel, in the order they were added
+        '''
+        return list(self._aside)
+
+    def has_field(self, fld):
+        return str(fld) in self._field_index or str(fld) in self._aside
+
+    def get_field_index(self, fld):
+        return self._field_index[str(fld)]
+
+    def get_ticker_index(self, ticker):
+        return self._ticker_index[ticker]
+
+    def field(self, fld):
+        '''
+        return a dates x tickers view of one field
+        '''
+        return self._get_block(fld).T
+
+    def _get_block(self, fld):
+        '''
+        tickers x dates values of one field
+        '''
+        fld = str(fld)
+        if fld in self._aside:
+            return self._aside[fld]
+        return self._data[self._field_index[fld]]
+
+    def series(self, ticker, fld):
+        '''
+        return the 1-D view of one field for one ticker
+        '''
+        return self._get_block(fld)[self._ticker_index[ticker]]
+
+    def add_field(self, fld, values):
+        '''
+        add (or overwrite) a field from a dates x tickers array
+        '''
+        fld = str(fld)
+        if fld not in self._field_index and self.fixed:
+            self._aside[fld] = np.ascontiguousarray(np.asarray(values, dtype = float).T)
+            return
+
+        if fld not in self._field_index:
+            num_fields = len(self.fields)
+            if num_fields == self._data.shape[0]:
+                # grow the capacity geometrically
+                data = np.empty((max(2 * num_fields, 1),) + self._data.shape[1:])
+                data[:num_fields] = self._data[:num_fields]
+                self._data = data
+            self._field_index[fld] = num_fields
+            self.fields.append(fld)
+
+        self._data[self._field_index[fld]] = np.asarray(values, dtype = float).T
+
+    def select_fields(self, fields):
+        '''
+        return a new panel with a copy of the given fields, in that order
+        '''
+        fields = [str(fld) for fld in fields]
+        if any(fld in self._aside for fld in fields):
+            values = np.array([self._get_block(fld) for fld in fields])
+        else:
+            values = self._data[[self._field_index[fld] for fld in fields]]
+        return Panel(self.dates, self.tickers, fields, values)
+
+    def to_2d(self):
+        '''
+        (field x ticker) x dates view of the panel, the rows are ordered as get_columns()
+        '''
+        values = self.values
+        return values.reshape(values.shape[0] * values.shape[1], values.shape[2])
+
+    def get_columns(self):
+        return [f"{ticker}_{fld}" for fld in self.fields for ticker in self.tickers]
+
+    def slice_dates(self, lo, hi):
+        '''
+        return a panel on the dates [lo, hi) sharing the memory of this panel
+        '''
+        return Panel(self.dates[lo:hi], self.tickers, self.fields, self.values[:, :, lo:hi])
+
+    @classmethod
+    def from_frame(cls, df, tickers):
+        '''
+        build a panel from the numeric {ticker}_{field} columns of a DataFrame.
+        The longest ticker matching the column prefix is used, so tickers and fields may contain '_'
+        Missing (ticker, field) pairs are set to NaN
+        '''
+        ticker_set = set(tickers)
+        located = []
+        fields = {}
+        for col in df.columns:
+            if not isinstance(col, str) or not pd.api.types.is_numeric_dtype(df[col].dtype):
+                continue
+            # try the longest prefix first
+            for pos in reversed([i for i, c in enumerate(col) if c == '_']):
+                if col[:pos] in ticker_set:
+                    located.append((col, col[:pos], col[pos + 1:]))
+                    fields.setdefault(col[pos + 1:], None)
+                    break
+
+        dates = pd.DatetimeIndex(df.index).values.astype('datetime64[D]')
+        panel = cls(dates, tickers, list(fields))
+        for col, ticker, fld in located:
+            panel._data[panel._field_index[fld], panel._ticker_index[ticker]] = df[col].to_numpy(dtype = float)
+        return panel
+
+
+class SharedPanel(object):
+
+    '''
+    Owner of a copy of a panel in shared memory. The descriptor is a small picklable tuple,
+    any process can attach() it to get a read-only Panel on the same memory without copying.
+    The owner must close() it once the other processes are done, this frees the memory
+    '''
+
+    def __init__(self, panel):
+        values = panel.values
+        self.shm = shared_memory.SharedMemory(create = True, size = max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype = values.dtype, buffer = self.shm.buf)[:] = values
+        self.descriptor = (self.shm.name, values.shape, values.dtype.str, panel.dates, panel.tickers, panel.fields)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.shm.close()
+            self.shm.unlink()
+
+    @staticmethod
+    def attach(descriptor):
+        '''
+        return a read-only Panel on the shared memory of a descriptor
+        '''
+        name, shape, dtype, dates, tickers, fields = descriptor
+        shm = shared_memory.SharedMemory(name = name)
+        values = np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+        values.flags.writeable = False
+
+        panel = Panel(dates, tickers, fields, values)
+        # the memory stays mapped as long as the panel is alive
+        panel._shm = shm
+        return panel
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    dates = np.arange('2020-01-01', '2020-01-06', dtype = 'datetime64[D]')
+    df = pd.DataFrame({'A_Close': [1., 2., 3., 4., 5.], 'B_C_Close': [6., 7., 8., 9., 10.], 'A_SMA_2': [np.nan, 1.5, 2.5, 3.5, 4.5]},
+                      index = dates.astype(object))
+
+    panel = Panel.from_frame(df, ['A', 'B_C'])
+    print(panel.shape, panel.fields, panel.get_columns())
+
+    close = panel.field('Close')
+    print(close, np.shares_memory(close, panel.values))
+
+    panel.add_field('SMA_1', close)
+    print(panel.field('SMA_1'), panel.series('B_C', 'SMA_1'))
+
+    with SharedPanel(panel) as shared:
+        view = SharedPanel.attach(shared.descriptor)
+        print(view.fields, np.array_equal(view.values, panel.values, equal_nan = True), view.values.flags.writeable)
+
+        # a field added to the attached panel is kept aside, the shared memory is not copied
+        view.add_field('SMA_3', close)
+        print(view.fixed, view.has_field('SMA_3'), view.fields, view.values.shape, view.field('SMA_3')[:, 0])
+
+if __name__ == '__main__':
+    _test()
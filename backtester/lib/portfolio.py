@@ -6,40 +6,63 @@ import os
 import enum
 import datetime
 import copy
+from array import array
 from collections import deque
 from datetime import date
 
+import numpy as np
+import pandas as pd
+
 import common as cm
 
 from preference import Preference
 
 class Position(object):
     '''
-    Closed or Open position by ticker
+    Closed or Open position by ticker. It is a view of one row of a TradeLedger
     '''
     class Type(enum.Enum):
         OPEN = "open"
         CLOSED = "closed"
 
-    def __init__(self, ticker, entry_date, shares_with_sign, entry_price, exit_date = None, exit_price = None, type = Type.OPEN):
-        self.ticker = ticker
+    __slots__ = ('ledger', 'row')
+
+    def __init__(self, ledger, row):
+        self.ledger = ledger
+        self.row = row
+
+    @property
+    def ticker(self):
+        return self.ledger.tickers[self.ledger.ticker_id[self.row]]
+
+    @property
+    def entry_date(self):
+        return date.fromordinal(self.ledger.entry_date[self.row])
 
-        self.entry_date = entry_date
+    @property
+    def shares_with_sign(self):
         # negative shares means it is a short position
-        self.shares_with_sign = shares_with_sign
+        return self.ledger.shares_with_sign[self.row]
 
-        self.entry_price = entry_price
-        self.exit_date = exit_date
-        self.exit_price = exit_price
-        self.type = type
+    @property
+    def entry_price(self):
+        return self.ledger.entry_price[self.row]
 
-        self.update()
+    @property
+    def type(self):
+        return Position.Type.CLOSED if self.ledger.status[self.row] else Position.Type.OPEN
 
-    def update(self):
-        if self.exit_price is not None:
-            self.pnl = self.shares_with_sign * (self.exit_price - self.entry_price)
-        else:
-            self.pnl = None
+    @property
+    def exit_date(self):
+        return date.fromordinal(self.ledger.exit_date[self.row]) if self.ledger.status[self.row] else None
+
+    @property
+    def exit_price(self):
+        return self.ledger.exit_price[self.row] if self.ledger.status[self.row] else None
+
+    @property
+    def pnl(self):
+        return self.ledger.pnl[self.row] if self.ledger.status[self.row] else None
 
     def __str__(self):
         txt = f"{self.ticker}: {self.type.value} position: entry_date: {self.entry_date}, entry_price: {self.entry_price} "
@@ -47,121 +70,220 @@ class Position(object):
         return (txt)
 
 
-class Portfolio(object):
+class TradeLedger(object):
+    '''
+    Columnar store of all the lots of a portfolio, one row per lot in the order they are created.
+    Each column is an array.array, so a lot takes a few dozen bytes instead of a Python object,
+    and the whole ledger converts to numpy arrays without copying for the export and the PnL aggregation.
+    The dates are stored as ordinals, the exit columns are only meaningful once the lot is closed
+    '''
+    OPEN = 0
+    CLOSED = 1
+
+    def __init__(self):
+        self.tickers = []
+        self._ticker_index = {}
+
+        self.ticker_id = array('i')
+        self.shares_with_sign = array('d')
+        self.entry_date = array('i')
+        self.entry_price = array('d')
+        self.exit_date = array('i')
+        self.exit_price = array('d')
+        self.status = array('b')
+        self.pnl = array('d')
+
+    def __len__(self):
+        return len(self.ticker_id)
+
+    def get_ticker_id(self, ticker):
+        if ticker not in self._ticker_index:
+            self._ticker_index[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+        return self._ticker_index[ticker]
+
+    def add_lot(self, ticker, entry_date, shares_with_sign, entry_price):
+        '''
+        add an open lot and return its row
+        '''
+        return self.add_lot_ordinal(self.get_ticker_id(ticker), entry_date.toordinal(), shares_with_sign, entry_price)
+
+    def add_lot_ordinal(self, ticker_id, entry_ordinal, shares_with_sign, entry_price):
+        '''
+        same as add_lot with the ticker id and the ordinal of the entry date
+        '''
+        self.ticker_id.append(ticker_id)
+        self.shares_with_sign.append(shares_with_sign)
+        self.entry_date.append(entry_ordinal)
+        self.entry_price.append(entry_price)
+        self.exit_date.append(0)
+        self.exit_price.append(np.nan)
+        self.status.append(TradeLedger.OPEN)
+        self.pnl.append(np.nan)
+        return len(self) - 1
+
+    def split_lot(self, row, shares_with_sign):
+        '''
+        move shares_with_sign out of the lot at row into a new lot with the same entry, return the new row
+        '''
+        new_row = self.add_lot_ordinal(self.ticker_id[row], self.entry_date[row], shares_with_sign, self.entry_price[row])
+        self.shares_with_sign[row] = self.shares_with_sign[row] - shares_with_sign
+        return new_row
+
+    def close_lot(self, row, exit_date, exit_price):
+        self.close_lot_ordinal(row, exit_date.toordinal(), exit_price)
+
+    def close_lot_ordinal(self, row, exit_ordinal, exit_price):
+        self.exit_date[row] = exit_ordinal
+        self.exit_price[row] = exit_price
+        self.status[row] = TradeLedger.CLOSED
+        self.pnl[row] = self.shares_with_sign[row] * (exit_price - self.entry_price[row])
+
+    def get_column(self, name):
+        '''
+        numpy view of a column
+        '''
+        column = getattr(self, name)
+        return np.frombuffer(column, dtype = column.typecode) if len(column) > 0 else np.array([], dtype = column.typecode)
+
+    def get_dates(self, name):
+        '''
+        datetime64 view of a date column
+        '''
+        return (self.get_column(name) - date(1970, 1, 1).toordinal()).astype('datetime64[D]')
+
+
+_epoch_ordinal = date(1970, 1, 1).toordinal()
+
+def _get_ordinals(dates):
+    '''
+    proleptic Gregorian ordinals (date.toordinal) of a sequence of dates, dates with a timezone keep their local date
     '''
-    class to model a portfolio. It has a dict from ticker to a list of closed position to that ticker for storing
-    historical trades. It also has a queue to manage current open positions, whose disposal method can be either FIFO or LIFO
+    index = pd.DatetimeIndex(dates)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return (index.values.astype('datetime64[D]').astype(np.int64) + _epoch_ordinal).tolist()
+
 
-    TODO: implement LIFO
+class Portfolio(object):
+    '''
+    class to model a portfolio. All the lots are rows of a TradeLedger, and for each ticker the portfolio
+    keeps a queue of the open long lots and a queue of the open short lots.
+    A trade only touches the lots it closes: the disposal method decides whether the oldest (FIFO)
+    or the most recent (LIFO) open lot is matched first
     '''
     def __init__(self, name, disposal_method = cm.DisposalMethod.FIFO):
         self.name = name
         self.disposal_method = disposal_method
-        # dict from ticker to a list of positions
-        self._positions_by_ticker = {}
+        self.ledger = TradeLedger()
+        # dict from ticker to a deque of the ledger rows of open lots, the most recent lot on the right
+        self._open_long_by_ticker = {}
+        self._open_short_by_ticker = {}
 
-        if disposal_method == cm.DisposalMethod.LIFO:
-            raise Exception(f"{disposal_method} is not currently supported, only FIFO is supported")
+        if disposal_method not in [cm.DisposalMethod.FIFO, cm.DisposalMethod.LIFO]:
+            raise Exception(f"{disposal_method} is not currently supported, only FIFO and LIFO are supported")
 
     def get_open_long_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.shares_with_sign > 0 and x.type == Position.Type.OPEN]
+        return [Position(self.ledger, row) for row in self._open_long_by_ticker.get(ticker, [])]
 
     def get_open_short_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.shares_with_sign < 0 and x.type == Position.Type.OPEN]
+        return [Position(self.ledger, row) for row in self._open_short_by_ticker.get(ticker, [])]
 
     def get_closed_positions(self, ticker):
-        return [x for x in self._positions_by_ticker[ticker] if x.type == Position.Type.CLOSED]
+        '''
+        closed lots of ticker in the order they were created
+        '''
+        ledger = self.ledger
+        if ticker not in ledger._ticker_index:
+            return []
+        rows = np.flatnonzero((ledger.get_column('ticker_id') == ledger._ticker_index[ticker]) &
+                              (ledger.get_column('status') == TradeLedger.CLOSED))
+        return [Position(ledger, row) for row in rows.tolist()]
 
     def get_positions_by_ticker(self, ticker):
         return self.get_closed_positions(ticker) + self.get_open_long_positions(ticker) + self.get_open_short_positions(ticker)
 
     def get_all_positions(self):
-        result = []
-        for ticker in self._positions_by_ticker.keys():
-            result += self.get_positions_by_ticker(ticker)
-        return result
+        return [Position(self.ledger, row) for row in self._get_sorted_rows()]
 
+    def _get_sorted_rows(self):
+        '''
+        rows of the ledger grouped by ticker, each with its closed lots, then open long lots, then open short lots
+        '''
+        ledger = self.ledger
+        status = ledger.get_column('status')
+        group = np.where(status == TradeLedger.CLOSED, 0, np.where(ledger.get_column('shares_with_sign') > 0, 1, 2))
+        return np.lexsort((group, ledger.get_column('ticker_id'))).tolist()
 
-    def _handle_buy(self, ticker, trade_action, trade_date, trade_price, trade_shares):
+
+    def _close_lots(self, lots, trade_ordinal, trade_price, trade_shares):
         '''
-        Close all short lots, if need to buy more, create open positions
+        close open lots in the disposal order until trade_shares are matched, the last lot
+        may be closed partially. Return the shares that are left once all the lots are closed
         '''
+        ledger = self.ledger
         outstanding_shares = trade_shares
-        # try closing with full lots first
-        for pos in self.get_open_short_positions(ticker):
-            if outstanding_shares >= abs(pos.shares_with_sign):
-                pos.type = Position.Type.CLOSED
-                pos.exit_date = trade_date
-                pos.exit_price = trade_price
-                pos.update()
-                outstanding_shares -= abs(pos.shares_with_sign)
-
-        # after closing as much as possible and there is still some outstanding shares
-        # then get the remaining open short positions
-        if outstanding_shares > 0:
-            for pos in self.get_open_short_positions(ticker):
-                # close partial
-                if outstanding_shares < abs(pos.shares_with_sign):
-                    partial_closed = copy.deepcopy(pos)
-                    partial_closed.type = Position.Type.CLOSED
-                    partial_closed.shares_with_sign = -1 * outstanding_shares
-
-                    # reduce the lot size of the existing open lot
-                    pos.shares_with_sign = pos.shares_with_sign + outstanding_shares
-
-                    # add the partial closed position to the trade record
-                    partial_closed.exit_date = trade_date
-                    partial_closed.exit_price = trade_price
-                    partial_closed.update()
-                    self._positions_by_ticker[ticker].append(partial_closed)
-
-                    outstanding_shares = 0
-                    break
-
-            # if there is still some outstanding_shares, add new long position
+        while outstanding_shares > 0 and len(lots) > 0:
+            row = lots[0] if self.disposal_method == cm.DisposalMethod.FIFO else lots[-1]
+            lot_shares = ledger.shares_with_sign[row]
+
+            # close the full lot
+            if outstanding_shares >= abs(lot_shares):
+                if self.disposal_method == cm.DisposalMethod.FIFO:
+                    lots.popleft()
+                else:
+                    lots.pop()
+                ledger.close_lot_ordinal(row, trade_ordinal, trade_price)
+                outstanding_shares -= abs(lot_shares)
+
+            # close partial lot, the existing open lot keeps the remaining shares
+            else:
+                sign = 1 if lot_shares > 0 else -1
+                partial_closed = ledger.split_lot(row, sign * outstanding_shares)
+                ledger.close_lot_ordinal(partial_closed, trade_ordinal, trade_price)
+                outstanding_shares = 0
+
+        return outstanding_shares
+
+    def _match_trade(self, ticker_id, longs, shorts, is_buy, trade_ordinal, trade_price, trade_shares):
+        '''
+        a buy closes short lots and a sell closes long lots, the shares left open a new lot on the side of the trade
+        '''
+        if is_buy:
+            outstanding_shares = self._close_lots(shorts, trade_ordinal, trade_price, trade_shares)
+            if outstanding_shares > 0:
+                longs.append(self.ledger.add_lot_ordinal(ticker_id, trade_ordinal, outstanding_shares, trade_price))
+        else:
+            outstanding_shares = self._close_lots(longs, trade_ordinal, trade_price, trade_shares)
             if outstanding_shares > 0:
-                self._positions_by_ticker[ticker].append(Position(ticker, trade_date, outstanding_shares, trade_price))
+                shorts.append(self.ledger.add_lot_ordinal(ticker_id, trade_ordinal, -1 * outstanding_shares, trade_price))
 
-    def _handle_sell(self, ticker, trade_action, trade_date, trade_price, trade_shares):
+    def _get_lots(self, ticker):
         '''
-        Close all long lots, if need to sell more, create open positions
+        (ticker id, open long lots, open short lots) of ticker, created on its first trade
         '''
-        outstanding_shares = trade_shares
-        # try closing with full lots first
-        for pos in self.get_open_long_positions(ticker):
-            if outstanding_shares >= abs(pos.shares_with_sign):
-                pos.type = Position.Type.CLOSED
-                pos.exit_date = trade_date
-                pos.exit_price = trade_price
-                pos.update()
-                outstanding_shares -= abs(pos.shares_with_sign)
-
-        # after closing as much as possible and there is still some outstanding shares left to sell
-        # then get the remaining open long positions
-        if outstanding_shares > 0:
-            for pos in self.get_open_long_positions(ticker):
-                # close partial lot
-                if outstanding_shares < abs(pos.shares_with_sign):
-                    partial_closed = copy.deepcopy(pos)
-                    partial_closed.type = Position.Type.CLOSED
-                    partial_closed.shares_with_sign = outstanding_shares
-
-                    # reduce the lot size of the existing open lot
-                    pos.shares_with_sign = pos.shares_with_sign - outstanding_shares
-
-                    # add the partial closed position to the trade record
-                    partial_closed.exit_date = trade_date
-                    partial_closed.exit_price = trade_price
-                    partial_closed.update()
-                    self._positions_by_ticker[ticker].append(partial_closed)
-
-                    outstanding_shares = 0
-                    break
-
-            # if there is still some outstanding_shares, add new short position
-            if outstanding_shares > 0:
-                self._positions_by_ticker[ticker].append(Position(ticker, trade_date, -1 * outstanding_shares, trade_price))
+        if ticker not in self._open_long_by_ticker:
+            self._open_long_by_ticker[ticker] = deque()
+            self._open_short_by_ticker[ticker] = deque()
+        return (self.ledger.get_ticker_id(ticker), self._open_long_by_ticker[ticker], self._open_short_by_ticker[ticker])
 
+    def _get_closing_shares(self, trade_action, longs, shorts):
+        '''
+        shares of a trade given without shares, e.g. SELL_TO_CLOSE_ALL sells all the open long shares
+        '''
+        if trade_action == cm.TradeAction.BUY_TO_CLOSE_ALL:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in shorts])
+        elif trade_action == cm.TradeAction.SELL_TO_CLOSE_ALL:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in longs])
+        elif trade_action == cm.TradeAction.BUY_TO_CLOSE_50:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in shorts])/2
+        elif trade_action == cm.TradeAction.BUY_TO_CLOSE_25:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in shorts])/4
+        elif trade_action == cm.TradeAction.SELL_TO_CLOSE_50:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in longs])/2
+        elif trade_action == cm.TradeAction.SELL_TO_CLOSE_25:
+            return sum([abs(self.ledger.shares_with_sign[row]) for row in longs])/4
+        return None
 
     def add_trade(self, ticker, trade_action, trade_date, trade_price, trade_shares):
         '''
@@ -172,63 +294,102 @@ class Portfolio(object):
         if trade_shares is not None and trade_shares < 0:
             raise Exception(f"Expect trade shares to be a positive numbers, received {trade_shares} instead.")
 
-        if trade_action is None or trade_action == cm.TradeAction.NONE:
+        # the trade action can be given as a TradeAction, its value or its code
+        trade_action = cm.decode_trade_action(cm.encode_trade_action(trade_action))
+        if trade_action == cm.TradeAction.NONE:
             return
 
-        if ticker not in self._positions_by_ticker.keys():
-            self._positions_by_ticker[ticker] = []
-
-        total_short_shares = sum([abs(x.shares_with_sign) for x in self.get_open_short_positions(ticker)])
-        total_long_shares = sum([abs(x.shares_with_sign) for x in self.get_open_long_positions(ticker)])
+        ticker_id, longs, shorts = self._get_lots(ticker)
 
         # overwrite trade shares if it is a closing trade
         if trade_shares is None:
-            if trade_action == cm.TradeAction.BUY_TO_CLOSE_ALL:
-                trade_shares = total_short_shares
-            elif trade_action == cm.TradeAction.SELL_TO_CLOSE_ALL:
-                trade_shares = total_long_shares
-            elif trade_action == cm.TradeAction.BUY_TO_CLOSE_50:
-                trade_shares = total_short_shares/2
-            elif trade_action == cm.TradeAction.BUY_TO_CLOSE_25:
-                trade_shares = total_short_shares/4
-            elif trade_action == cm.TradeAction.SELL_TO_CLOSE_50:
-                trade_shares = total_long_shares/2
-            elif trade_action == cm.TradeAction.SELL_TO_CLOSE_25:
-                trade_shares = total_long_shares/4
-
-        if cm.is_a_buy(trade_action):
-            self._handle_buy(ticker, trade_action, trade_date, trade_price, trade_shares)
-
-        elif cm.is_a_sell(trade_action):
-            self._handle_sell(ticker, trade_action, trade_date, trade_price, trade_shares)
+            trade_shares = self._get_closing_shares(trade_action, longs, shorts)
+
+        if cm.is_a_buy(trade_action) or cm.is_a_sell(trade_action):
+            self._match_trade(ticker_id, longs, shorts, cm.is_a_buy(trade_action), trade_date.toordinal(),
+                              trade_price, trade_shares)
+
+
+    def add_trades(self, ticker, trade_actions, trade_dates, trade_prices, trade_shares):
+        '''
+        add a batch of trades of one ticker in date order, equivalent to calling add_trade for each of them.
+        The actions are TradeAction or their codes, e.g. the int8 actions of an OrderList which are used as is.
+        The actions, the shares and the dates are checked and converted for the whole batch with numpy,
+        then the buys and the sells are matched against the open lots of the ticker in one loop
+        '''
+        codes = cm.encode_trade_actions(trade_actions)
+        is_buy = cm.is_buy(codes)
+        trades = np.flatnonzero(is_buy | cm.is_sell(codes))
+        if len(trades) == 0:
+            return
 
+        # None shares (closing trades) become NaN
+        shares = np.asarray(trade_shares)
+        closing = np.zeros(len(shares), dtype = bool)
+        if shares.dtype == object:
+            closing = np.array([x is None for x in shares], dtype = bool)
+            shares = np.where(closing, np.nan, shares)
+        shares = shares.astype(float)
+        negative = np.flatnonzero(shares[trades] < 0)
+        if len(negative) > 0:
+            raise Exception(f"Expect trade shares to be a positive numbers, received {shares[trades][negative[0]]} instead.")
+
+        ordinals = _get_ordinals(trade_dates)
+        prices = np.asarray(trade_prices, dtype = float)
+
+        ticker_id, longs, shorts = self._get_lots(ticker)
+        for k in trades.tolist():
+            trade_shares_k = shares[k]
+            if closing[k]:
+                trade_shares_k = self._get_closing_shares(cm.decode_trade_action(codes[k]), longs, shorts)
+            self._match_trade(ticker_id, longs, shorts, is_buy[k], ordinals[k], prices[k], trade_shares_k)
 
     def close_all_open_positions(self, pricing_matrix):
         '''
         Get all open positions, close them all with the last row
         '''
         exit_date = pricing_matrix.index[-1]
-        for pos in self.get_open_long_positions() + self.get_open_short_positions():
-            pos.exit_date = exit_date
-            pos.exit_price = pricing_matrix[pos.ticker][-1]
-            pos.type = Position.Type.CLOSED
-            pos.update()
+        for ticker in self._open_long_by_ticker.keys():
+            for lots in [self._open_long_by_ticker[ticker], self._open_short_by_ticker[ticker]]:
+                for row in lots:
+                    self.ledger.close_lot(row, exit_date, pricing_matrix[ticker].iloc[-1])
+                lots.clear()
+
+    def get_trade_history(self):
+        '''
+        DataFrame of all the lots, in the same order as get_all_positions()
+        '''
+        ledger = self.ledger
+        rows = np.array(self._get_sorted_rows(), dtype = int)
+        closed = ledger.get_column('status')[rows] == TradeLedger.CLOSED
+
+        df = pd.DataFrame({'Ticker': np.array(ledger.tickers, dtype = object)[ledger.get_column('ticker_id')[rows]],
+                           'Shares With Sign': ledger.get_column('shares_with_sign')[rows],
+                           'Entry Date': ledger.get_dates('entry_date')[rows],
+                           'Entry Price': ledger.get_column('entry_price')[rows],
+                           'Exit Date': np.where(closed, ledger.get_dates('exit_date')[rows], np.datetime64('NaT')),
+                           'Exit Price': np.where(closed, ledger.get_column('exit_price')[rows], np.nan),
+                           'Status': np.where(closed, Position.Type.CLOSED.value, Position.Type.OPEN.value),
+                           'PnL': np.where(closed, ledger.get_column('pnl')[rows], np.nan)})
+        return df
+
+    def get_realized_pnl(self):
+        '''
+        total PnL of the closed lots by ticker
+        '''
+        ledger = self.ledger
+        closed = ledger.get_column('status') == TradeLedger.CLOSED
+        pnl = np.bincount(ledger.get_column('ticker_id')[closed], weights = ledger.get_column('pnl')[closed],
+                          minlength = len(ledger.tickers))
+        return pd.Series(pnl, index = ledger.tickers)
 
     def save_trade_history(self, output_fname):
-        fout = open(output_fname, 'w')
-        header = "Ticker,Shares With Sign,Entry Date,Entry Price,Exit Date,Exit Price,Status,PnL\n"
-        fout.write(header)
-        for pos in self.get_all_positions():
-            txt = f"{pos.ticker},{pos.shares_with_sign},{pos.entry_date},{pos.entry_price},"
-            txt += f"{pos.exit_date},{pos.exit_price},{pos.type.value},{pos.pnl}"
-            fout.write('%s\n' % txt.replace('None',''))
-        fout.close()
+        self.get_trade_history().to_csv(output_fname, index = False)
 
     def summary(self):
         ''' short summary
         '''
-        pos = self.get_all_positions()
-        txt = f"Trade count: {len(pos)}"
+        txt = f"Trade count: {len(self.ledger)}"
         return (txt)
 
 
@@ -288,6 +449,15 @@ def _test1():
     for pos in port.get_all_positions():
         print(pos)
 
+    # the sell closes the most recent lot first
+    lifo_port = Portfolio('test_lifo', disposal_method = cm.DisposalMethod.LIFO)
+    for trade in [('AWO', cm.TradeAction.BUY, d1, 100, 100), ('AWO', cm.TradeAction.BUY, d2, 110, 50),
+                  ('AWO', cm.TradeAction.SELL, d3, 120, 80)]:
+        lifo_port.add_trade(trade[0], trade[1], trade[2], trade[3], trade[4])
+
+    for pos in lifo_port.get_all_positions():
+        print(pos)
+
 
     output_fname = os.path.join(pref.test_output_dir, f"{port.name}_trade_history.csv")
     print("Saving trade history to ", output_fname)
@@ -6,14 +6,12 @@ import sys
 import getpass
 import argparse
 import warnings
-import pandas as pd
 
 import common as cm
 
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 warnings.simplefilter(action='ignore', category=UserWarning)
-warnings.simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
 
 
 
@@ -39,11 +37,21 @@ class Preference(object):
                         'train_data_dir': os.path.join(_data_root, 'train'),
                         'test_data_dir': os.path.join(_data_root, 'test'),
                         'meta_data_dir': os.path.join(_data_root, 'meta'),
+                        'data_dir': None,
                         'test_input_dir': os.path.join(_test_root, 'output'),
                         'test_output_dir': os.path.abspath(os.path.join(os.environ["ROOT_DIR"], os.pardir, 'output')),
                         'tickers': None, 'port_name': None,
                         'random_seed': None,
                         'risk_free_rate': 0.0,
+                        'num_workers': 1,
+                        'use_cache': True,
+                        'cache_dir': os.path.join(_data_root, 'cache'),
+                        'indicator_cache_size': 1024,
+                        'output_format': 'csv',
+                        'output_profile': 'full',
+                        'num_writers': 1,
+                        'profile': False,
+                        'profile_memory': False,
                     }
 
     def __init__(self, name = None, user = None, cli_args = None):
@@ -66,6 +74,9 @@ class Preference(object):
         if self.user is None:
             self.user = getpass.getuser()
 
+        if self.cache_dir is None:
+            self.cache_dir = Preference._default_option['cache_dir']
+
         # convert str to date object
         if self.start_date is not None:
             self.start_date = cm.parse_date_str(self.start_date)
@@ -95,9 +106,21 @@ def get_default_parser():
 
     parser.add_argument('--tickers', dest='tickers', default=None, help='Tickers with | separator')
 
-    parser.add_argument('--data_dir', dest = 'data_dir', default=None, help='data dir')
+    parser.add_argument('--data_dir', dest = 'data_dir', default=None, help='data dir of the daily price files, the train data by default')
     parser.add_argument('--output_dir', dest = 'output_dir', default=None, help='output dir')
 
+    parser.add_argument('--num_workers', dest='num_workers', default=1, type=int, help='number of worker processes, 0 for all cores')
+    parser.add_argument('--no_cache', action='store_false', dest='use_cache', default=True, help='do not use the on-disk price cache')
+    parser.add_argument('--cache_dir', dest = 'cache_dir', default=None, help='price cache dir')
+    parser.add_argument('--output_format', dest='output_format', default='csv', choices=['csv', 'npz'], help='format of the strategy output files')
+    parser.add_argument('--output_profile', dest='output_profile', default='full', choices=['full', 'results', 'pnl'],
+                        help='strategy output to save: full (with the input data), results or pnl only')
+    parser.add_argument('--num_writers', dest='num_writers', default=1, type=int, help='number of background threads saving the outputs, 0 to save them right away')
+    parser.add_argument('--profile', action='store_true', dest='profile', default=False, help='time the stages of the backtest, print and save them as json')
+    parser.add_argument('--profile_memory', action='store_true', dest='profile_memory', default=False,
+                        help='also record the memory peak of each stage (with tracemalloc, slower), implies --profile')
+    parser.add_argument('--indicator_cache_size', dest='indicator_cache_size', default=1024, type=int, help='size limit of the indicator cache in MB')
+
     return(parser)
 
 # ==============================================
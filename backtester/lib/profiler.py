@@ -0,0 +1,163 @@
+'''
+Timing and memory peak of the stages of a backtest
+'''
+
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+import pandas as pd
+
+
+class StageProfiler(object):
+
+    '''
+    StageProfiler records the elapsed time, and optionally the memory peak, of named stages.
+
+    1. Stages nest: a stage started within another one is recorded as parent/name, under the owner
+       (e.g. the strategy name) of the outermost stage, so the table adds up from the top
+    2. With trace_memory, the peak is the highest memory allocated by python and numpy (tracemalloc)
+       during the stage above what was allocated when it started. It slows down the run noticeably.
+       The peak is process wide, a stage running alongside another thread sees its allocations as well
+    3. The records of another process (a worker of a process pool) are added with add_records()
+    '''
+
+    def __init__(self, trace_memory = False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # [start memory, peak memory] of the open stages of all the threads
+        self._open = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, owner = None):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if len(stack) > 0:
+            owner = stack[-1]['owner']
+            name = stack[-1]['stage'] + '/' + name
+
+        record = {'owner': owner, 'stage': name, 'seconds': None}
+        with self._lock:
+            self.records.append(record)
+            if self.trace_memory:
+                memory = self._reset_peak()
+                self._open.append(memory)
+        stack.append(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            stack.pop()
+            if self.trace_memory:
+                with self._lock:
+                    self._reset_peak()
+                    self._open.remove(memory)
+                record['peak_memory'] = memory[1] - memory[0]
+
+    def _reset_peak(self):
+        '''
+        pass the peak since the last reset on to the open stages, then start a new peak.
+        Return [current, current] for a stage starting now
+        '''
+        current, peak = tracemalloc.get_traced_memory()
+        for memory in self._open:
+            memory[1] = max(memory[1], peak)
+        tracemalloc.reset_peak()
+        return [current, current]
+
+    def add_records(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def collect(self):
+        '''
+        return the records and start over
+        '''
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def to_frame(self):
+        '''
+        one row per owner and stage, in the order they started by owner, with the number of calls and the total time.
+        The peak memory (MB) is the highest peak of the calls
+        '''
+        columns = ['owner', 'stage', 'seconds'] + (['peak_memory'] if self.trace_memory else [])
+        df = pd.DataFrame([record for record in self.records if record['seconds'] is not None], columns = columns)
+        df['owner'] = df['owner'].fillna('')
+        # the stages of an owner together, the stages of other threads may start in between
+        first = {owner: k for k, owner in enumerate(df['owner'].unique())}
+        df = df.iloc[df['owner'].map(first).to_numpy().argsort(kind = 'stable')]
+        agg = {'calls': ('seconds', 'size'), 'seconds': ('seconds', 'sum')}
+        if self.trace_memory:
+            agg['peak MB'] = ('peak_memory', lambda x: x.max() / 2 ** 20)
+        return df.groupby(['owner', 'stage'], sort = False).agg(**agg).reset_index()
+
+    def format_table(self):
+        df = self.to_frame()
+        if len(df) == 0:
+            return 'No stage recorded'
+        return df.to_string(index = False, float_format = lambda x: f"{x:.3f}")
+
+    def save_to_json(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({'trace_memory': self.trace_memory, 'records': self.records,
+                       'stages': self.to_frame().to_dict(orient = 'records')}, f, indent = 2)
+
+
+# the profiler of the process, None when profiling is off
+_active = None
+_null_stage = contextlib.nullcontext()
+
+def enable(trace_memory = False):
+    global _active
+    _active = StageProfiler(trace_memory)
+    return _active
+
+def disable():
+    global _active
+    _active = None
+
+def get_profiler():
+    return _active
+
+def stage(name, owner = None):
+    '''
+    context recording a stage with the active profiler, it does nothing when profiling is off
+    '''
+    if _active is None:
+        return _null_stage
+    return _active.stage(name, owner)
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import numpy as np
+
+    enable(trace_memory = True)
+    for k in range(3):
+        with stage('run_strategy', f"strategy {k}"):
+            with stage('run_model'):
+                x = np.ones((1000, 1000 * (k + 1)))
+                del x
+            with stage('build_portfolio'):
+                time.sleep(0.01)
+    print(get_profiler().format_table())
+    disable()
+
+    with stage('not recorded'):
+        pass
+    print(get_profiler())
+
+if __name__ == '__main__':
+    _test()
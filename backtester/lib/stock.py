@@ -8,10 +8,8 @@ import pandas as pd
 import numpy as np
 import datetime
 
-import pandas_ta as ta
-
-
 import common as cm
+import indicator
 from loader import DataLoader
 from preference import get_default_parser, Preference
 
@@ -29,25 +27,43 @@ class Stock(object):
         self.ohlcv_df = None
 
 
-    def get_daily_hist_price(self, start_date = None, end_date = None):
-        self.ohlcv_df = self.loader.get_daily_hist_price(self.ticker, start_date, end_date)
-        self._calc_daily_basic()
+    def get_daily_hist_price(self, start_date = None, end_date = None, fields = None):
+        '''
+        load the price history and calculate the derived fields.
+        If fields is given, only the columns needed for them are read and only the derived fields among them are calculated
+        '''
+        if fields is None:
+            raw_fields = None
+            derived_fields = None
+        else:
+            fields = [str(fld) for fld in fields]
+            raw_fields = indicator.get_raw_inputs(fields)
+            derived_fields = [fld for fld in fields if indicator.is_derived(fld)]
+
+        self.ohlcv_df = self.loader.get_daily_hist_price(self.ticker, start_date, end_date, raw_fields)
+        self._calc_daily_basic(derived_fields)
         return(self)
 
-    def _calc_daily_basic(self):
+    def _calc_daily_basic(self, fields = None):
         '''
-        Calculate the most common moving averages, technical indicators and returns
+        Calculate derived fields from the indicator registry, by default
+        the most common moving averages, technical indicators and returns.
+        The results are kept in the loader's indicator cache when it is enabled
         '''
-        for period in [10, 20, 50, 200]:
-            self.ohlcv_df[f"SMA_{period}"] = ta.sma(self.ohlcv_df[cm.DataField.close], timeperiod = period)
+        if fields is None:
+            fields = indicator.get_default_fields()
 
-        c = self.ohlcv_df[cm.DataField.close]
-        self.ohlcv_df['daily_returns'] = (c - c.shift(1))/c.shift(1)
-        self.ohlcv_df['weekly_returns'] = (c - c.shift(5))/c.shift(1)
-        self.ohlcv_df['monthly_returns'] = (c - c.shift(20))/c.shift(1)
+        cache = self.loader.indicator_cache
+        sources = None if cache is None else [self.loader.get_source_key(self.ticker)]
+        dates = pd.DatetimeIndex(self.ohlcv_df.index).values.astype('datetime64[D]')
 
-        std_rsi_period = 14
-        self.ohlcv_df[cm.DataField.RSI.value] = ta.rsi(self.ohlcv_df[cm.DataField.close], timeperiod = std_rsi_period)
+        def get_input(name):
+            if name not in self.ohlcv_df.columns:
+                self.ohlcv_df[name] = indicator.calculate_cached(name, get_input, cache, dates, [self.ticker], sources)
+            return self.ohlcv_df[name].to_numpy(dtype = float)
+
+        for fld in fields:
+            get_input(fld)
 
 
     def grab_fields(self, in_fields = None):
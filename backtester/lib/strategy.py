@@ -2,12 +2,17 @@
 Class to model a strategy
 '''
 import os
+import json
+import datetime
+import numpy as np
 import pandas as pd
 
 import common as cm
+import profiler
 
 from datamatrix import DataMatrix
 from portfolio import Portfolio
+from orderlist import OrderList
 
 class Strategy():
 
@@ -22,7 +27,8 @@ class Strategy():
 
        a. input_datamatrix with everything needed for generating a trade signal.
        b. trade signal datamatrix which is the output of the strategy, long or short
-       c. trade action datamatrix which buy to open, buy to close or sell to open or sell to close
+       c. trade action datamatrix which buy to open, buy to close or sell to open or sell to close,
+          stored as the int8 codes of TradeAction (cm.TradeAction.BUY.code)
        d. shares_datamatrix which is how many shares for each trade, it is always positive
 
        From the two output matrix, one can generate the following datamatrix
@@ -45,7 +51,7 @@ class Strategy():
         self.initial_capital = initial_capital
         self.price_choice = price_choice
 
-        self.pricing_matrix = self.input_dm.extract_price_matrix().copy()
+        self.pricing_matrix = self.get_pricing_matrix()
 
         # set up property based on the input datamatrix
         self.num_period = self.input_dm.shape[0]
@@ -74,6 +80,12 @@ class Strategy():
                             'Maximum Drawdown': -999,
                             'Sharpe Ratio': -999}
 
+    def get_pricing_matrix(self):
+        '''
+        return a copy of the prices of the input datamatrix, with the ticker as column label
+        '''
+        return self.input_dm.extract_price_matrix().copy()
+
     def validate(self, input_datamatrix):
         '''
         validate to see if it has everything first
@@ -86,6 +98,7 @@ class Strategy():
         Run any model underlying the strategy, generate a trading signal, a trading action and the shares datamatrix
         Trading signal has either long (1), sell (-1) or hold (0)
         Shares indicate how many shares to buy or sell and are positive
+        Alternatively, return an OrderList with one row per order, which is much smaller when trades are sparse
         '''
         raise Exception("Should not be calling the Strategy Base class run_model method")
 
@@ -94,39 +107,45 @@ class Strategy():
         '''
         Call the run_model, then run the strategy.
         Calculate the state of the strategy period by period.
+        run_model returns either an OrderList or the dense (tsignal, taction, shares) DataFrames
         '''
-        self.tsignal, self.taction, self.shares = self.run_model()
+        with profiler.stage('run_model', self.name):
+            result = self.run_model()
+        nrow, ncol = self.pricing_matrix.shape
+
+        if isinstance(result, OrderList):
+            self.orders = result
+            self.tsignal, self.taction, self.shares = None, None, None
+        else:
+            self.tsignal, self.taction, self.shares = result
+
+            nrow1, ncol1 = self.tsignal.shape
+            nrow2, ncol2 = self.taction.shape
+            nrow3, ncol3 = self.shares.shape
+
+            if nrow != nrow1 or ncol != ncol1:
+                raise Exception(f"Pricing Matrix size don't matter in generate trade history")
 
-        nrow, ncol   = self.pricing_matrix.shape
-        nrow1, ncol1 = self.tsignal.shape
-        nrow2, ncol2 = self.taction.shape
-        nrow3, ncol3 = self.shares.shape
+            if nrow1 != nrow2 or nrow2 != nrow3:
+                raise Exception(f"Number of row don't matter in generate trade history")
+            if ncol1 != ncol2 or ncol2 != ncol3:
+                raise Exception(f"Number of column don't matter in generate trade history")
 
-        if nrow != nrow1 or ncol != ncol1:
-            raise Exception(f"Pricing Matrix size don't matter in generate trade history")
+            self.shares.fillna(0, inplace=True)
+            self.tsignal.fillna(0, inplace=True)
+            self.orders = OrderList.from_dense(self.tsignal, self.taction, self.shares)
 
-        if nrow1 != nrow2 or nrow2 != nrow3:
-            raise Exception(f"Number of row don't matter in generate trade history")
-        if ncol1 != ncol2 or ncol2 != ncol3:
-            raise Exception(f"Number of column don't matter in generate trade history")
+        self.orders.validate(nrow, ncol)
 
-        self.current_holding = (self.shares * self.tsignal).cumsum()
+        self.current_holding = pd.DataFrame(self.orders.get_holding(nrow, ncol), index = self.pricing_matrix.index,
+                                            columns = self.pricing_matrix.columns)
         self.equity_exposure = (self.current_holding * self.pricing_matrix).sum(axis = 1)
 
-        cash_val = self.initial_capital
-        self.shares.fillna(0, inplace=True)
-        self.tsignal.fillna(0, inplace=True)
         self.pricing_matrix.fillna(0, inplace=True)
 
-        for i in range(nrow):
-            for j in range(ncol):
-                # executing trades
-                trade_amt = self.shares.iloc[i, j] * self.tsignal.iloc[i, j] * self.pricing_matrix.iloc[i, j]
-                cash_val = cash_val - trade_amt
-
-            # assume cash grow with risk free rate
-            cash_val = cash_val * (1 + self.pref.risk_free_rate * self.days_between_periods/365)
-            self.cash.iloc[i] = cash_val
+        # executing trades
+        trade_amt = self.orders.get_trade_amount(self.pricing_matrix.to_numpy(dtype = float))
+        self.cash = pd.Series(self._calc_cash(self.orders.date_index, trade_amt, nrow), index = self.input_dm.index)
 
         self.pnl = pd.DataFrame(data = {'cash': self.cash, 'equity_exposure': self.equity_exposure,
                                         'total_value': self.cash + self.equity_exposure,}
@@ -141,24 +160,51 @@ class Strategy():
             self._calc_daily_stat()
 
 
-    def generate_trade_history(self, output_fname):
+    def _calc_cash(self, date_index, trade_amt, nrow):
         '''
+        cash at the end of each period: the trades of the period are paid for, then the cash grows
+        with the risk free rate, i.e. cash[i] = (cash[i-1] - sum(trade_amt[i])) * growth.
+        trade_amt is the amount of each order, date_index its period, the orders are sorted by date
         '''
-        self.port = Portfolio(self.name)
-        nrow, ncol = self.pricing_matrix.shape
+        # assume cash grow with risk free rate
+        growth = 1 + self.pref.risk_free_rate * self.days_between_periods/365
 
-        for i in range(nrow):
-            trade_date = self.pricing_matrix.index[i]
-            for j in range(ncol):
-                ticker = self.tsignal.columns[j]
-                action = self.taction.iloc[i, j]
-                shares = self.shares.iloc[i, j]
-                price = self.pricing_matrix.iloc[i, j]
+        if growth == 1:
+            # a running sum over the orders, which gives exactly the same rounding
+            # as paying for the trades one at a time
+            running_cash = np.cumsum(np.concatenate(([self.initial_capital], -trade_amt)))
+            return running_cash[np.searchsorted(date_index, np.arange(nrow), side = 'right')]
 
-                self.port.add_trade(ticker, action, trade_date, price, shares)
+        # cash[i] = growth**(i+1) * (initial_capital - sum_{k<=i} trades[k] / growth**k)
+        compound = np.cumprod(np.full(nrow, growth))
+        discount = np.concatenate(([1.0], compound[:-1]))
+        period_amt = np.bincount(date_index, weights = trade_amt, minlength = nrow)
+        return compound * (self.initial_capital - np.cumsum(period_amt / discount))
 
+    def generate_trade_history(self, output_fname):
+        '''
+        replay the orders through a Portfolio and save the resulting lots
+        '''
+        self.build_portfolio()
         self.port.save_trade_history(output_fname)
 
+    def build_portfolio(self):
+        '''
+        replay the orders through a Portfolio
+        '''
+        with profiler.stage('trade_history', self.name):
+            self.port = Portfolio(self.name)
+
+            # the orders with a buy or a sell are passed to the portfolio, ticker by ticker in date order
+            orders = self.orders
+            trade_dates = self.pricing_matrix.index
+            prices = self.pricing_matrix.to_numpy()
+
+            for j, rows in orders.get_trades_by_ticker():
+                date_index = orders.date_index[rows]
+                self.port.add_trades(self.pricing_matrix.columns[j], orders.actions[rows], trade_dates[date_index], prices[date_index, j],
+                                     np.abs(orders.shares_with_sign[rows]))
+
 
     def _calc_daily_stat(self):
         '''
@@ -177,7 +223,27 @@ class Strategy():
         pass
 
 
-    def save_to_csv(self, output_dir):
+    def save_output(self, output_dir):
+        '''
+        Save strategy output with the format (pref.output_format) and the profile (pref.output_profile)
+        of the preference. The profiles are
+        1. full: everything, including the input data and the prices
+        2. results: everything the strategy calculated, i.e. the orders, holding, pnl and trade history
+        3. pnl: only the pnl
+        '''
+        profile = self.pref.output_profile
+        if profile not in output_profiles:
+            raise Exception(f"Unknown output profile {profile}, expect one of {output_profiles}")
+
+        with profiler.stage('save_output', self.name):
+            if self.pref.output_format == 'csv':
+                self.save_to_csv(output_dir, profile)
+            elif self.pref.output_format == 'npz':
+                self.save_to_npz(output_dir, profile)
+            else:
+                raise Exception(f"Unknown output format {self.pref.output_format}, expect csv or npz")
+
+    def save_to_csv(self, output_dir, profile = 'full'):
         '''
         Save strategy output to csv file
         '''
@@ -185,17 +251,137 @@ class Strategy():
             os.makedirs(output_dir, exist_ok=True)
 
         fname = self.name.replace(' ', '')
-        self.input_dm.to_csv(os.path.join(output_dir, f"{fname}_data.csv"))
-        self.pricing_matrix.to_csv(os.path.join(output_dir, f"{fname}_prices.csv"))
-        self.taction.to_csv(os.path.join(output_dir,  f"{fname}_taction.csv"))
-        self.tsignal.to_csv(os.path.join(output_dir, f"{fname}_tsignal.csv"))
-        self.shares.to_csv(os.path.join(output_dir, f"{fname}_shares.csv"))
+        if profile == 'pnl':
+            self.pnl.to_csv(os.path.join(output_dir, f"{fname}_pnl.csv"))
+            self.build_portfolio()
+            return
+
+        if profile == 'full':
+            # the DataMatrix may be shared with a strategy running in another thread
+            with self.input_dm.lock:
+                self.input_dm.save_to_csv(os.path.join(output_dir, f"{fname}_data.csv"))
+            self.pricing_matrix.to_csv(os.path.join(output_dir, f"{fname}_prices.csv"))
+        if self.taction is None:
+            self.orders.to_frame(self.pricing_matrix.index, self.pricing_matrix.columns).to_csv(
+                os.path.join(output_dir, f"{fname}_orders.csv"), index = False)
+        else:
+            taction = self.taction
+            if np.issubdtype(taction.to_numpy().dtype, np.integer):
+                taction = pd.DataFrame(cm.decode_trade_actions(taction.to_numpy()), index = taction.index, columns = taction.columns)
+            taction.to_csv(os.path.join(output_dir,  f"{fname}_taction.csv"))
+            self.tsignal.to_csv(os.path.join(output_dir, f"{fname}_tsignal.csv"))
+            self.shares.to_csv(os.path.join(output_dir, f"{fname}_shares.csv"))
         self.current_holding.to_csv(os.path.join(output_dir, f"{fname}_holding.csv"))
 
         self.pnl.to_csv(os.path.join(output_dir, f"{fname}_pnl.csv"))
 
         self.generate_trade_history(os.path.join(output_dir, f"{fname}_trade_history.csv"))
 
+    def save_to_npz(self, output_dir, profile = 'full'):
+        '''
+        Save strategy output as the columns of each table in one compressed {name}.npz file,
+        along with a {name}_manifest.json describing the tables. read_npz_output() loads them back as DataFrames
+        '''
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        fname = self.name.replace(' ', '')
+        arrays = {'dates': self.pricing_matrix.index.to_numpy(dtype = 'datetime64[D]')}
+        tables = {}
+
+        def add_table(table, columns, kind):
+            tables[table] = {'kind': kind, 'columns': list(columns)}
+            for k, values in enumerate(columns.values()):
+                arrays[f"{table}.{k}"] = values
+
+        def add_matrix(table, values):
+            tables[table] = {'kind': 'matrix'}
+            arrays[table] = values
+
+        if profile == 'full':
+            with self.input_dm.lock:
+                panel = self.input_dm.panel
+                tables['data'] = {'kind': 'panel', 'tickers': list(panel.tickers), 'fields': list(panel.fields)}
+                arrays['data'] = panel.values
+                # the fields kept aside by a fixed panel, saved on their own not to copy the shared values
+                if len(panel.aside_fields) > 0:
+                    tables['data']['aside_fields'] = panel.aside_fields
+                    for k, fld in enumerate(panel.aside_fields):
+                        arrays[f"data.aside.{k}"] = panel.field(fld).T
+            add_matrix('prices', self.pricing_matrix.to_numpy(dtype = float))
+
+        if profile != 'pnl':
+            if self.taction is None:
+                orders = self.orders
+                add_table('orders', {'date_index': orders.date_index, 'ticker_index': orders.ticker_index,
+                                     'shares_with_sign': orders.shares_with_sign, 'actions': orders.actions}, 'orders')
+            else:
+                add_matrix('taction', cm.encode_trade_actions(self.taction.to_numpy()))
+                add_matrix('tsignal', self.tsignal.to_numpy(dtype = float))
+                add_matrix('shares', self.shares.to_numpy(dtype = float))
+            add_matrix('holding', self.current_holding.to_numpy(dtype = float))
+
+        add_table('pnl', {col: self.pnl[col].to_numpy(dtype = float) for col in self.pnl.columns}, 'dates')
+
+        self.build_portfolio()
+        if profile != 'pnl':
+            history = self.port.get_trade_history()
+            add_table('trade_history', {col: history[col].to_numpy(dtype = str if history[col].dtype == object else None)
+                                        for col in history.columns}, 'rows')
+
+        manifest = {'name': self.name,
+                    'profile': profile,
+                    'file': f"{fname}.npz",
+                    'created': datetime.datetime.now().isoformat(timespec = 'seconds'),
+                    'initial_capital': float(self.initial_capital),
+                    'performance': {k: float(v) for k, v in self.performance.items()},
+                    'tickers': [str(x) for x in self.pricing_matrix.columns],
+                    'tables': tables}
+
+        np.savez_compressed(os.path.join(output_dir, f"{fname}.npz"), **arrays)
+        with open(os.path.join(output_dir, f"{fname}_manifest.json"), 'w') as f:
+            json.dump(manifest, f, indent = 2)
+
+
+output_profiles = ['full', 'results', 'pnl']
+
+def read_npz_output(manifest_fname):
+    '''
+    load the tables saved by Strategy.save_to_npz, return the manifest and a dict of DataFrames
+    in the same layout as the csv files (the data table has the {ticker}_{field} columns)
+    '''
+    with open(manifest_fname) as f:
+        manifest = json.load(f)
+
+    result = {}
+    with np.load(os.path.join(os.path.dirname(manifest_fname), manifest['file'])) as arrays:
+        dates = pd.Index(arrays['dates'].astype(object), name = 'Date')
+        tickers = manifest['tickers']
+
+        for table, info in manifest['tables'].items():
+            if info['kind'] == 'panel':
+                values = arrays[table]
+                aside = info.get('aside_fields', [])
+                if len(aside) > 0:
+                    values = np.concatenate([values] + [arrays[f"{table}.aside.{k}"][None] for k in range(len(aside))])
+                columns = [f"{ticker}_{fld}" for fld in info['fields'] + aside for ticker in info['tickers']]
+                df = pd.DataFrame(values.reshape(-1, values.shape[-1]).T, index = dates, columns = columns)
+            elif info['kind'] == 'matrix':
+                values = arrays[table]
+                if table == 'taction':
+                    values = cm.decode_trade_actions(values)
+                df = pd.DataFrame(values, index = dates, columns = tickers)
+            elif info['kind'] == 'orders':
+                orders = OrderList(*[arrays[f"{table}.{k}"] for k in range(len(info['columns']))])
+                df = orders.to_frame(dates, tickers)
+            else:
+                df = pd.DataFrame({col: arrays[f"{table}.{k}"] for k, col in enumerate(info['columns'])})
+                if info['kind'] == 'dates':
+                    df.index = dates
+            result[table] = df
+
+    return (manifest, result)
+
 
 # ==============================================
 # Testing
@@ -0,0 +1,239 @@
+'''
+Class to evaluate a strategy on a grid of parameters
+'''
+
+import os
+import math
+import itertools
+import concurrent.futures
+import pandas as pd
+
+import common as cm
+
+from datamatrix import share_with_workers
+
+
+class ParameterSweep(object):
+
+    '''
+    ParameterSweep runs a Strategy subclass once for every combination of a parameter grid and
+    collects the performance dict of each run into one table.
+
+    1. The DataMatrix is loaded by the caller and shared by all the runs
+    2. param_grid maps a constructor argument of the strategy to the list of values to try,
+       fixed_params are passed unchanged to every run
+    3. When pref.num_workers is not 1, the combinations are evaluated in a process pool.
+       The sweep (and its DataMatrix) is handed to each worker once when the worker starts,
+       with the fork start method the workers simply inherit it without any copy,
+       otherwise the DataMatrix goes through shared memory
+    '''
+
+    def __init__(self, pref, strategy_class, input_datamatrix, initial_capital, param_grid, **fixed_params):
+        self.pref = pref
+        self.strategy_class = strategy_class
+        self.input_dm = input_datamatrix
+        self.initial_capital = initial_capital
+        self.param_grid = {name: list(values) for name, values in param_grid.items()}
+        self.fixed_params = fixed_params
+        self.results = None
+
+        for name, values in self.param_grid.items():
+            if len(values) == 0:
+                raise Exception(f"No value to sweep for parameter {name}")
+
+    def get_combinations(self):
+        '''
+        return the list of parameter dicts, the last parameter of the grid varies the fastest
+        '''
+        names = list(self.param_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*self.param_grid.values())]
+
+    def create_strategy(self, params):
+        return self.strategy_class(self.pref, self.input_dm, self.initial_capital, **self.fixed_params, **params)
+
+    def evaluate(self, params):
+        '''
+        run the strategy with one combination of parameters and return its performance
+        '''
+        strategy = self.create_strategy(params)
+        strategy.validate()
+        strategy.run_strategy()
+        return dict(strategy.performance)
+
+    def run(self):
+        '''
+        evaluate all the combinations, return a DataFrame with one row per combination:
+        the parameters followed by the performance
+        '''
+        combinations = self.get_combinations()
+        performance = self.evaluate_all(combinations)
+
+        self.results = pd.concat([pd.DataFrame(combinations), pd.DataFrame(performance)], axis = 1)
+        return self.results
+
+    def evaluate_all(self, combinations):
+        '''
+        return the list of the performance of each combination, in a process pool when pref.num_workers is not 1
+        '''
+        num_workers = self.pref.num_workers
+        if num_workers is None or num_workers <= 0:
+            num_workers = os.cpu_count()
+
+        if num_workers > 1 and len(combinations) > 1:
+            chunksize = max(1, len(combinations) // (4 * num_workers))
+            shared = share_with_workers([self.input_dm])
+            try:
+                with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers, initializer = _init_worker,
+                                                            initargs = (self,)) as executor:
+                    performance = list(executor.map(_evaluate, combinations, chunksize = chunksize))
+            finally:
+                for owner in shared:
+                    owner.close()
+        else:
+            performance = [self.evaluate(params) for params in combinations]
+        return performance
+
+    def get_best(self, n = 10, metric = 'Sharpe Ratio'):
+        '''
+        return the n best combinations according to a performance metric
+        '''
+        if self.results is None:
+            raise Exception("The sweep has not been run yet")
+        return self.results.sort_values(metric, ascending = False, kind = 'stable').head(n)
+
+    def save_to_csv(self, output_dir):
+        '''
+        Save the results table to csv file
+        '''
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        fname = self.strategy_class.__name__
+        self.results.to_csv(os.path.join(output_dir, f"{fname}_sweep.csv"), index = False)
+
+
+class SuccessiveHalving(ParameterSweep):
+
+    '''
+    Early stopping version of ParameterSweep (successive halving)
+    1. every combination is first evaluated on a short prefix of the dates
+    2. only the best 1/eta of them according to metric are evaluated again, on a prefix eta times longer
+    3. the last rung is the whole period
+
+    A strategy only looks at the past, so its run on a prefix is the beginning of its run on the whole period
+    and the performance on the prefix is the running performance of the full run at that date.
+    The prefixes share the memory of the DataMatrix.
+    '''
+
+    def __init__(self, pref, strategy_class, input_datamatrix, initial_capital, param_grid, eta = 3, min_periods = 252,
+                 metric = 'Sharpe Ratio', **fixed_params):
+        super().__init__(pref, strategy_class, input_datamatrix, initial_capital, param_grid, **fixed_params)
+        if eta < 2:
+            raise Exception(f"eta must be at least 2, received {eta} instead")
+        self.eta = eta
+        self.min_periods = min_periods
+        self.metric = metric
+        self.history = None
+
+    def get_rungs(self):
+        '''
+        return the number of dates of each rung, from the shortest prefix to the whole period.
+        There is no point in a rung once a single combination is left
+        '''
+        num_combinations = len(self.get_combinations())
+        rungs = [self.input_dm.shape[0]]
+        while rungs[0] // self.eta >= self.min_periods and self.eta ** len(rungs) < num_combinations * self.eta:
+            rungs.insert(0, rungs[0] // self.eta)
+        return rungs
+
+    def run(self):
+        '''
+        run the rungs, return a DataFrame with one row per combination: the parameters, the last rung
+        it reached with its number of dates, then its performance on that rung
+        '''
+        combinations = self.get_combinations()
+        rungs = self.get_rungs()
+        nrow = self.input_dm.shape[0]
+
+        candidates = list(range(len(combinations)))
+        history = []
+        for r, periods in enumerate(rungs):
+            dm = self.input_dm if periods == nrow else self.input_dm.slice_dates(0, periods)
+            sweep = ParameterSweep(self.pref, self.strategy_class, dm, self.initial_capital, {}, **self.fixed_params)
+
+            rung = pd.DataFrame(sweep.evaluate_all([combinations[k] for k in candidates]), index = candidates)
+            rung.insert(0, 'Rung', r)
+            rung.insert(1, 'Periods', periods)
+            history.append(rung)
+
+            if self.pref.verbose:
+                print(f"Rung {r}: {len(candidates)} combinations on {periods} periods")
+
+            # keep the best ones for the next rung, a missing metric is ranked last
+            num_keep = max(1, math.ceil(len(candidates) / self.eta))
+            ranked = rung.sort_values(self.metric, ascending = False, kind = 'stable', na_position = 'last')
+            candidates = sorted(ranked.index[:num_keep])
+
+        self.history = pd.concat(history)
+        last = self.history[~self.history.index.duplicated(keep = 'last')].sort_index()
+        self.results = pd.concat([pd.DataFrame(combinations), last], axis = 1)
+        return self.results
+
+    def get_best(self, n = 10, metric = None):
+        '''
+        return the n best combinations, the ones which reached the last rung first
+        '''
+        if self.results is None:
+            raise Exception("The sweep has not been run yet")
+        metric = self.metric if metric is None else metric
+        return self.results.sort_values(['Rung', metric], ascending = False, kind = 'stable').head(n)
+
+    def save_to_csv(self, output_dir):
+        '''
+        Save the results table and the performance of every combination on every rung it reached to csv file
+        '''
+        super().save_to_csv(output_dir)
+
+        fname = self.strategy_class.__name__
+        self.history.to_csv(os.path.join(output_dir, f"{fname}_sweep_rungs.csv"), index_label = 'Combination')
+
+
+# the sweep of a worker process, set once by the pool initializer
+_worker_sweep = None
+
+def _init_worker(sweep):
+    global _worker_sweep
+    _worker_sweep = sweep
+
+def _evaluate(params):
+    return _worker_sweep.evaluate(params)
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import datetime
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+    from RSI_strategy import RSIStrategy
+
+    pref = Preference()
+    universe = ['AWO', 'BDJ', 'BDTC']
+    loader = DataMatrixLoader(pref, 'test', universe, datetime.date(2013, 1, 1), datetime.date(2023, 1, 1))
+    dm = loader.get_daily_datamatrix()
+
+    sweep = ParameterSweep(pref, RSIStrategy, dm, cm.OneMillion,
+                           {'lower_bound': [10, 20, 30], 'upper_bound': [70, 80, 90]}, risk_allocation_percentage = 5)
+    print(sweep.run())
+    print(sweep.get_best(3))
+
+    halving = SuccessiveHalving(pref, RSIStrategy, dm, cm.OneMillion,
+                                {'lower_bound': [10, 20, 30], 'upper_bound': [70, 80, 90]}, eta = 2, min_periods = 252,
+                                risk_allocation_percentage = 5)
+    print(halving.get_rungs())
+    print(halving.run())
+    print(halving.get_best(3))
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,237 @@
+'''
+Generator of synthetic daily price data for scale testing
+'''
+
+import os
+import datetime
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+import common as cm
+
+
+def _child_seed(seed_sequence, k):
+    '''
+    the k-th child of seed_sequence, the same as seed_sequence.spawn(k + 1)[k] without changing seed_sequence
+    '''
+    return np.random.SeedSequence(seed_sequence.entropy, spawn_key = seed_sequence.spawn_key + (k,))
+
+
+class SyntheticMarket(object):
+
+    '''
+    SyntheticMarket writes daily price files in the same csv schema as the data set
+    (Date with the New York timezone suffix, Open, High, Low, Close, Volume, Dividends, Stock Splits, Ticker)
+    and a universe file listing the tickers.
+
+    1. The trading calendar is the business days without the US federal holidays
+    2. A market factor follows a geometric Brownian motion, it is also written as the SPY file
+       so that the universe has a benchmark
+    3. The close of each ticker is a geometric Brownian motion driven by beta x the market factor
+       plus its own noise and Poisson jumps
+    4. Some tickers are listed after the first date or delisted before the last one, a few dates are
+       missing at random (gaps) or in a row (halts), and some tickers pay quarterly dividends.
+       As in the data set the prices are split adjusted, a split only shows in the Stock Splits column
+
+    Every ticker draws from its own numpy generator spawned from seed, so a ticker does not depend
+    on the number of tickers generated or on the number of worker processes.
+    '''
+
+    columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits', 'Ticker']
+
+    def __init__(self, num_tickers, start_date, end_date, seed = None, gap_rate = 0.002, halt_rate = 0.1,
+                 listing_rate = 0.3, delisting_rate = 0.1, split_rate = 0.05, jump_rate = 2.0, dividend_rate = 0.3):
+        self.num_tickers = num_tickers
+        self.start_date = start_date
+        self.end_date = end_date
+        # probability of a missing date, and number of halts per year
+        self.gap_rate = gap_rate
+        self.halt_rate = halt_rate
+        # fraction of the tickers listed after the first date, delisted before the last date, paying dividends
+        self.listing_rate = listing_rate
+        self.delisting_rate = delisting_rate
+        self.dividend_rate = dividend_rate
+        # number of splits and of jumps per year
+        self.split_rate = split_rate
+        self.jump_rate = jump_rate
+
+        seed_sequence = np.random.SeedSequence(seed)
+        self.seed = seed_sequence.entropy
+        self.market_seed, self.ticker_seeds = seed_sequence.spawn(2)
+
+        self.calendar = self.get_trading_calendar(start_date, end_date)
+        self.date_strings = self.format_dates(self.calendar)
+        self.tickers = [f"SYN{k:05d}" for k in range(num_tickers)]
+
+        rng = np.random.default_rng(self.market_seed)
+        self.market_returns = self._gbm_returns(rng, len(self.calendar), 0.07, 0.18)
+
+    @staticmethod
+    def get_trading_calendar(start_date, end_date):
+        holidays = USFederalHolidayCalendar().holidays(start = start_date, end = end_date)
+        return pd.bdate_range(start_date, end_date).difference(holidays)
+
+    @staticmethod
+    def format_dates(calendar):
+        '''
+        dates as in the data files, e.g. 2019-12-31 00:00:00-05:00
+        '''
+        text = calendar.tz_localize('America/New_York').strftime('%Y-%m-%d %H:%M:%S%z')
+        return np.array([s[:-2] + ':' + s[-2:] for s in text])
+
+    @staticmethod
+    def _gbm_returns(rng, n, mu, sigma):
+        '''
+        daily log returns of a geometric Brownian motion with annual drift mu and volatility sigma
+        '''
+        dt = 1 / 252
+        return (mu - sigma ** 2 / 2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(n)
+
+    def generate_index(self, ticker = 'SPY'):
+        '''
+        the market factor as a ticker, on every date of the calendar
+        '''
+        rng = np.random.default_rng(_child_seed(self.market_seed, 0))
+        rows = np.arange(len(self.calendar))
+        return (rows, self._make_ohlcv(rng, 400.0, self.market_returns, 0.18, 8e7))
+
+    def generate_ticker(self, k):
+        '''
+        return the rows of the calendar where ticker k trades and its columns
+        '''
+        rng = np.random.default_rng(_child_seed(self.ticker_seeds, k))
+        n = len(self.calendar)
+        min_days = min(60, n)
+
+        # listing and delisting
+        first = rng.integers(0, max(1, n - min_days)) if rng.random() < self.listing_rate else 0
+        last = rng.integers(first + min_days, n + 1) if rng.random() < self.delisting_rate else n
+        rows = np.arange(first, last)
+
+        beta = rng.uniform(0.5, 1.5)
+        sigma = rng.uniform(0.15, 0.5)
+        returns = beta * self.market_returns[rows] + self._gbm_returns(rng, len(rows), rng.normal(0.02, 0.05), sigma)
+
+        # jumps, a compound Poisson process
+        num_jumps = rng.poisson(self.jump_rate / 252, len(rows))
+        returns += num_jumps * rng.normal(-0.01, 0.08, len(rows))
+
+        price = np.exp(rng.normal(np.log(30), 1))
+        volume = np.exp(rng.normal(np.log(1e6), 1))
+        columns = self._make_ohlcv(rng, price, returns, sigma, volume)
+
+        # quarterly dividends
+        if rng.random() < self.dividend_rate:
+            pay = np.arange(rng.integers(0, 63), len(rows), 63)
+            columns['Dividends'][pay] = np.round(columns['Close'][pay] * rng.uniform(0.01, 0.04) / 4, 4)
+
+        # splits, the prices are adjusted already
+        split = rng.random(len(rows)) < self.split_rate / 252
+        columns['Stock Splits'][split] = rng.choice([2.0, 3.0, 1.5, 0.5], split.sum())
+
+        # missing dates
+        keep = rng.random(len(rows)) >= self.gap_rate
+        for _ in range(rng.poisson(self.halt_rate * len(rows) / 252)):
+            start = rng.integers(0, len(rows))
+            keep[start:start + rng.integers(2, 11)] = False
+        keep[0] = True
+
+        return (rows[keep], {col: values[keep] for col, values in columns.items()})
+
+    @staticmethod
+    def _make_ohlcv(rng, price, returns, sigma, volume):
+        n = len(returns)
+        daily_sigma = sigma / np.sqrt(252)
+        close = price * np.exp(np.cumsum(returns))
+        previous = np.concatenate(([price], close[:-1]))
+
+        open_ = previous * np.exp(rng.normal(0, daily_sigma / 4, n))
+        high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, daily_sigma / 2, n)))
+        low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, daily_sigma / 2, n)))
+        volume = np.round(volume * np.exp(rng.normal(0, 0.3, n)))
+
+        return {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume,
+                'Dividends': np.zeros(n), 'Stock Splits': np.zeros(n)}
+
+    def format_csv(self, ticker, rows, columns):
+        fmt = f"%s,%.6f,%.6f,%.6f,%.6f,%d,%.4f,%g,{ticker}"
+        lines = [fmt % values for values in zip(self.date_strings[rows], columns['Open'], columns['High'], columns['Low'],
+                                                columns['Close'], columns['Volume'], columns['Dividends'],
+                                                columns['Stock Splits'])]
+        return ','.join(self.columns) + '\n' + '\n'.join(lines) + '\n'
+
+    def write_ticker(self, output_dir, k):
+        '''
+        write the file of ticker k, return its number of rows
+        '''
+        ticker = self.tickers[k]
+        rows, columns = self.generate_ticker(k)
+        with open(os.path.join(output_dir, f"{ticker}.csv"), 'w') as f:
+            f.write(self.format_csv(ticker, rows, columns))
+        return len(rows)
+
+    def write(self, output_dir, meta_data_dir, universe_name, num_workers = 1):
+        '''
+        write the data files of all the tickers and of the SPY index in output_dir, and the universe file
+        in meta_data_dir. Return the total number of rows written
+        '''
+        os.makedirs(output_dir, exist_ok = True)
+        os.makedirs(meta_data_dir, exist_ok = True)
+
+        rows, columns = self.generate_index()
+        with open(os.path.join(output_dir, 'SPY.csv'), 'w') as f:
+            f.write(self.format_csv('SPY', rows, columns))
+
+        if num_workers is None or num_workers <= 0:
+            num_workers = os.cpu_count()
+
+        if num_workers > 1 and self.num_tickers > 1:
+            chunksize = max(1, self.num_tickers // (4 * num_workers))
+            with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers, initializer = _init_worker,
+                                                        initargs = (self, output_dir)) as executor:
+                counts = list(executor.map(_write_ticker, range(self.num_tickers), chunksize = chunksize))
+        else:
+            counts = [self.write_ticker(output_dir, k) for k in range(self.num_tickers)]
+
+        fname = os.path.join(meta_data_dir, universe_name.replace(' ', '') + '.txt')
+        pd.DataFrame({'Ticker': self.tickers}).to_csv(fname, index = False)
+        return len(rows) + sum(counts)
+
+
+# the generator of a worker process, set once by the pool initializer
+_worker_market = None
+_worker_output_dir = None
+
+def _init_worker(market, output_dir):
+    global _worker_market, _worker_output_dir
+    _worker_market = market
+    _worker_output_dir = output_dir
+
+def _write_ticker(k):
+    return _worker_market.write_ticker(_worker_output_dir, k)
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import tempfile
+    from preference import Preference
+    from datamatrix import DataMatrixLoader
+
+    output_dir = tempfile.mkdtemp()
+    market = SyntheticMarket(20, datetime.date(2015, 1, 1), datetime.date(2020, 1, 1), seed = 1)
+    print(market.write(os.path.join(output_dir, 'data'), os.path.join(output_dir, 'meta'), 'Synthetic Universe'))
+
+    pref = Preference()
+    pref.data_dir = os.path.join(output_dir, 'data')
+    universe = cm.get_index_components('Synthetic Universe', os.path.join(output_dir, 'meta'))
+    loader = DataMatrixLoader(pref, 'synthetic', universe, datetime.date(2015, 1, 1), datetime.date(2020, 1, 1))
+    dm = loader.get_daily_datamatrix()
+    print(dm.shape, cm.get_ETF_by_index('Synthetic Universe'))
+    print(dm.iloc[:5, :6])
+
+if __name__ == '__main__':
+    _test()
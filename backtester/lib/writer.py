@@ -0,0 +1,106 @@
+'''
+Class to save strategy outputs in background threads
+'''
+
+import atexit
+import queue
+import threading
+
+
+class OutputWriter(object):
+
+    '''
+    OutputWriter saves strategy outputs (Strategy.save_output) in background threads,
+    so that the next strategy runs while the files of the previous one are written.
+
+    1. submit() blocks when max_pending outputs are waiting already, which bounds the memory
+       held by strategies that are done but not saved yet
+    2. wait() blocks until everything submitted is saved, then raises an Exception listing
+       the outputs that could not be saved
+    3. with num_threads = 0, submit() saves the output right away in the calling thread
+    '''
+
+    def __init__(self, output_dir, num_threads = 1, max_pending = None):
+        self.output_dir = output_dir
+        self.num_threads = num_threads
+        self.max_pending = 2 * num_threads if max_pending is None else max_pending
+        self.errors = []
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, strategy):
+        if self.num_threads <= 0:
+            strategy.save_output(self.output_dir)
+            return
+
+        if len(self._threads) == 0:
+            self._start()
+        self._queue.put(strategy)
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize = self.max_pending)
+        self._threads = [threading.Thread(target = self._drain, name = f"OutputWriter-{k}", daemon = True)
+                         for k in range(self.num_threads)]
+        for thread in self._threads:
+            thread.start()
+        # the threads are daemon threads, make sure the pending outputs are saved on exit
+        atexit.register(self.wait)
+
+    def _drain(self):
+        while True:
+            strategy = self._queue.get()
+            if strategy is None:
+                break
+            try:
+                strategy.save_output(self.output_dir)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append((strategy.name, e))
+
+    def wait(self):
+        '''
+        wait for all the submitted outputs to be saved and stop the threads
+        '''
+        if len(self._threads) > 0:
+            atexit.unregister(self.wait)
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+        if len(self.errors) > 0:
+            errors, self.errors = self.errors, []
+            raise Exception("Failed to save the output of " +
+                            ", ".join(f"{name} ({type(e).__name__}: {e})" for name, e in errors)) from errors[0][1]
+
+
+# ==============================================
+# Testing
+# ==============================================
+def _test():
+    import time
+
+    class Output(object):
+        def __init__(self, name, fail = False):
+            self.name = name
+            self.fail = fail
+
+        def save_output(self, output_dir):
+            time.sleep(0.1)
+            if self.fail:
+                raise OSError(f"cannot write to {output_dir}")
+            print(f"saved {self.name}")
+
+    writer = OutputWriter('/tmp', num_threads = 1)
+    for k in range(3):
+        writer.submit(Output(f"output {k}", fail = k == 1))
+    print("all submitted")
+    try:
+        writer.wait()
+    except Exception as e:
+        print(e)
+
+if __name__ == '__main__':
+    _test()
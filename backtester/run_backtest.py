@@ -19,7 +19,7 @@ import backtester
 
 # import YOUR strategies here
 from RSI_strategy import RSIStrategy
-from random_strategy import RandomStrategy
+from random_strategy import RandomStrategy, RandomMonteCarlo
 
 def create_strategy_list(pref, datamatrix_loader):
     result = []
@@ -34,12 +34,25 @@ def create_strategy_list(pref, datamatrix_loader):
 
     return (result)
 
+def run_monte_carlo(pref, dm):
+    '''
+    run pref.monte_carlo replicas of the random strategy and print the distribution of their performance
+    '''
+    mc = RandomMonteCarlo(pref, dm, pref.initial_capital, pref.monte_carlo, lower_bound = 0.1, upper_bound = 0.9)
+    mc.validate()
+    mc.run_strategy()
+    mc.save_to_csv(pref.output_dir)
+
+    print(f"Monte Carlo of {mc.num_replicas} random strategy replicas (seed {mc.seed}):")
+    print(mc.get_distribution())
+
 def run():
 
     parser = preference.get_default_parser()
     parser.add_argument('--universe_name',   dest='universe_name', default = 'OwlHack 2024 Universe', help='Name of the Universe')
     parser.add_argument('--initial_capital', dest='initial_capital', default = cm.OneMillion, help='Initial Capital')
     parser.add_argument('--random_seed', dest='random_seed', default = None, type = int, help='Random Seed')
+    parser.add_argument('--monte_carlo', dest='monte_carlo', default = 0, type = int, help='Number of random strategy replicas in a Monte Carlo run, 0 to skip it')
 
     args = parser.parse_args()
     pref = preference.Preference(cli_args = args)
@@ -58,5 +71,8 @@ def run():
     driver.run(strategy_list)
     driver.summary()
 
+    if pref.monte_carlo > 0:
+        run_monte_carlo(pref, strategy_list[-1].input_dm)
+
 if __name__ == "__main__":
     run()
@@ -0,0 +1,68 @@
+'''
+Script to run the microbenchmarks and compare them with a saved baseline
+
+    python run_microbench.py run --results results.json [--baseline baseline.json]
+    python run_microbench.py compare --baseline baseline.json --results results.json
+'''
+
+# import native libraries
+import os
+import sys
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "strategy"))
+
+# import the internal libraries
+import preference
+import microbench
+
+def parse_scales(text):
+    return [int(x) for x in text.split(',')]
+
+def print_comparison(baseline, results, threshold):
+    df = microbench.compare_results(baseline, results, threshold)
+    df['median baseline'] *= 1000
+    df['median current'] *= 1000
+    print(df.rename(columns = {'median baseline': 'baseline (ms)', 'median current': 'current (ms)'}).to_string(
+        index = False, float_format = lambda x: f"{x:.3f}"))
+
+    slower = (df['status'] == 'slower').sum()
+    print(f"{len(df)} benchmarks compared, {slower} slower and {(df['status'] == 'faster').sum()} faster "
+          f"by more than {threshold:.0%}")
+    return slower
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('command', choices = ['run', 'compare'], help='run the benchmarks or compare two result files')
+    parser.add_argument('--filter', dest='filter', default = None, help='regular expression selecting the benchmarks by name')
+    parser.add_argument('--tickers_scales', dest='tickers_scales', default = '10,100,1000', help='numbers of tickers, comma separated')
+    parser.add_argument('--years_scales', dest='years_scales', default = '1,5,20', help='numbers of years, comma separated')
+    parser.add_argument('--repeat', dest='repeat', default = 5, type = int, help='number of timed runs of each benchmark')
+    parser.add_argument('--results', dest='results', default = 'microbench.json', help='result file (json) of the run command to save or compare')
+    parser.add_argument('--baseline', dest='baseline', default = None, help='baseline result file (json) to compare with')
+    parser.add_argument('--threshold', dest='threshold', default = 0.1, type = float, help='relative change of the median time reported as slower or faster')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    if pref.command == 'run':
+        benchmarks = microbench.get_benchmarks(pref.filter)
+        results = microbench.run_benchmarks(pref, benchmarks, parse_scales(pref.tickers_scales), parse_scales(pref.years_scales),
+                                            pref.repeat, data_dir = pref.data_dir)
+        microbench.save_results(results, pref.results)
+        print(f"Results saved to {pref.results}")
+    else:
+        results = microbench.load_results(pref.results)
+
+    if pref.baseline is not None:
+        slower = print_comparison(microbench.load_results(pref.baseline), results, pref.threshold)
+        sys.exit(1 if slower > 0 else 0)
+    elif pref.command == 'compare':
+        raise Exception("compare needs a --baseline result file")
+
+if __name__ == "__main__":
+    run()
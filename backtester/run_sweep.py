@@ -0,0 +1,106 @@
+'''
+Script to run a strategy on a grid of parameters
+'''
+
+# import native libraries
+import os
+import sys
+import time
+
+# append the lib directory to the path
+os.environ["ROOT_DATA_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir ,'data'))
+os.environ["ROOT_DIR"] = os.path.abspath(os.path.join(os.path.dirname(__file__)))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "lib"))
+sys.path.append(os.path.join(os.environ["ROOT_DIR"], "strategy"))
+
+# import the internal libraries
+import preference
+import common as cm
+
+from datamatrix import DataMatrixLoader
+from sweep import ParameterSweep, SuccessiveHalving
+
+# import YOUR strategies here
+from RSI_strategy import RSIStrategy
+from random_strategy import RandomStrategy
+
+strategies = {'RSI': RSIStrategy, 'Random': RandomStrategy}
+
+# 1,000 combinations of the RSI strategy parameters
+default_grids = {
+    'RSI': {'lower_bound': [10, 15, 20, 25, 30],
+            'upper_bound': [70, 75, 80, 85, 90],
+            'target_gain_percentage': [0.5, 1.0, 1.5, 2.0, 3.0],
+            'max_loss_percentage': [-0.5, -1.0, -2.0, -4.0],
+            'risk_allocation_percentage': [5, 10]},
+    'Random': {'lower_bound': [0.05, 0.1, 0.2],
+               'upper_bound': [0.8, 0.9, 0.95]},
+}
+
+def parse_param(text):
+    '''
+    parse name=v1,v2,v3 into (name, [v1, v2, v3]), the values are converted to int or float when possible
+    '''
+    if '=' not in text:
+        raise Exception(f"Expect a parameter as name=v1,v2,..., received {text} instead")
+    name, values = text.split('=', 1)
+
+    def convert(value):
+        for func in (int, float):
+            try:
+                return func(value)
+            except ValueError:
+                pass
+        return value
+
+    return (name.strip(), [convert(v.strip()) for v in values.split(',')])
+
+def run():
+
+    parser = preference.get_default_parser()
+    parser.add_argument('--universe_name',   dest='universe_name', default = 'OwlHack 2024 Universe', help='Name of the Universe')
+    parser.add_argument('--initial_capital', dest='initial_capital', default = cm.OneMillion, help='Initial Capital')
+    parser.add_argument('--random_seed', dest='random_seed', default = None, type = int, help='Random Seed')
+    parser.add_argument('--strategy', dest='strategy', default = 'RSI', choices = list(strategies), help='Strategy to sweep')
+    parser.add_argument('--param', dest='params', action = 'append', default = None,
+                        help='parameter values to sweep as name=v1,v2,... (repeat for each parameter), replaces the default grid')
+    parser.add_argument('--eta', dest='eta', default = 0, type = int,
+                        help='keep the best 1/eta of the combinations on growing date prefixes (successive halving), 0 to evaluate all of them on the whole period')
+    parser.add_argument('--min_periods', dest='min_periods', default = 252, type = int, help='Minimum number of dates of the first successive halving rung')
+    parser.add_argument('--top', dest='top', default = 10, type = int, help='Number of best combinations to print')
+
+    args = parser.parse_args()
+    pref = preference.Preference(cli_args = args)
+
+    if pref.output_dir is None:
+        pref.output_dir = pref.test_output_dir
+
+    if pref.params is None:
+        param_grid = default_grids[pref.strategy]
+    else:
+        param_grid = dict(parse_param(text) for text in pref.params)
+
+    universe = cm.get_index_components(pref.universe_name, pref.meta_data_dir)
+    loader = DataMatrixLoader(pref, pref.universe_name, universe, pref.start_date, pref.end_date)
+    dm = loader.get_daily_datamatrix()
+
+    if pref.eta > 0:
+        sweep = SuccessiveHalving(pref, strategies[pref.strategy], dm, pref.initial_capital, param_grid,
+                                  eta = pref.eta, min_periods = pref.min_periods)
+    else:
+        sweep = ParameterSweep(pref, strategies[pref.strategy], dm, pref.initial_capital, param_grid)
+    num_combinations = len(sweep.get_combinations())
+    print(f"Running {pref.strategy} on {num_combinations} combinations of {', '.join(param_grid)}")
+    if pref.eta > 0:
+        print(f"Successive halving rungs (number of dates): {sweep.get_rungs()}")
+
+    start = time.perf_counter()
+    sweep.run()
+    elapsed = time.perf_counter() - start
+    sweep.save_to_csv(pref.output_dir)
+
+    print(f"Completed in {elapsed:.1f}s ({elapsed / num_combinations:.3f}s per combination), output in {pref.output_dir}")
+    print(sweep.get_best(pref.top).to_string(index = False))
+
+if __name__ == "__main__":
+    run()
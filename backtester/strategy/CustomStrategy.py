@@ -1,4 +1,7 @@
 # CustomStrategy.py
+import numpy as np
+import pandas as pd
+
 import common as cm
 from strategy import Strategy
 from datamatrix import DataMatrix, DataMatrixLoader
@@ -28,11 +31,14 @@ class CustomStrategy(Strategy):
         Run the strategy.
         Your strategy would need to return the three variation below.
             tsignal: a panda dataframe with column as being the stock Ticker and the row as the Date
-            taction: a panda dataframe with column as being the stock Ticker and the row as the Date
+            taction: a panda dataframe with column as being the stock Ticker and the row as the Date,
+                     holding the int8 codes of the trade actions such as cm.TradeAction.BUY.code
             shares: a panda dataframe with column as being the stock Ticker and the row as the Date
+        A strategy that trades rarely can return an OrderList instead, with one row per order.
         '''
 
-        taction = self.pricing_matrix.copy()
+        taction = pd.DataFrame(cm.TradeAction.NONE.code, index = self.pricing_matrix.index,
+                               columns = self.pricing_matrix.columns, dtype = np.int8)
         tsignal = self.pricing_matrix.copy()
 
         # shares on trade execution
@@ -3,11 +3,11 @@ Classes for Buy and Hold
 '''
 
 import datetime
-import pandas as pd
-import pandas_ta as ta
+import numpy as np
 
 import common as cm
 from strategy import Strategy
+from orderlist import OrderList
 from datamatrix import DataMatrix, DataMatrixLoader
 
 class RSIStrategy(Strategy):
@@ -44,116 +44,75 @@ class RSIStrategy(Strategy):
 
     def _calc_RSI(self):
         '''
-        As an illustration, calculate a second RSI indicator with a different period
+        As an illustration, calculate a second RSI indicator with a different period.
+        It is calculated on first access and stored in the input datamatrix as {ticker}_RSI_20
         '''
-        for ticker in self.universe:
-            price = self.input_dm[f"{ticker}_{cm.DataField.close}"]
-            self.input_dm[f"{ticker}_RSI2"] = ta.rsi(price, timeperiod = 20)
+        self.input_dm.field('RSI_20')
 
     def run_model(self, model = None):
         '''
         No external prediction model needed
-        return a trade signal and its corresponding shares
+        return the orders of the strategy. The dates are processed one at a time and
+        all the tickers are updated at once with numpy arrays
         '''
 
         # as an illustration how one can add an new technical indicator for a particular strategy
         self._calc_RSI()
 
-        RSI = cm.DataField.RSI.value
-
         # when RSI is above 80, trade signal is sell, when RSI is below 20, trade signal is buy
         nrow, ncol   = self.pricing_matrix.shape
-
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-
-        # shares on trade execution
-        shares = self.pricing_matrix.copy()
-
-        # existing shares with sign
-        current_shares_with_sign = self.pricing_matrix.copy()
+        prices = self.pricing_matrix.to_numpy(dtype = float)
+        rsi = self.input_dm.field(cm.DataField.RSI)
         dollar_exposure = self.initial_capital * self.risk_allocation_percentage/100
 
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares  *= 0
-        current_shares_with_sign *= 0
+        # existing shares with sign by ticker, a ticker without price on the first day never trades
+        current_shares_with_sign = np.where(np.isnan(prices[0]), np.nan, 0.0)
+        # remember the price when a trade was put on by ticker
+        entry_price = np.full(ncol, np.nan)
 
-        # remember the price and the date index when a trade was put on by ticker
-        entry_day_index = {}
-        entry_price = {}
-
-        for j in range(ncol):
-            ticker = self.pricing_matrix.columns[j]
-            rsi = self.input_dm[f"{ticker}_{RSI}"]
+        date_index, ticker_index, shares_with_sign, actions = [], [], [], []
 
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
             for i in range(1, nrow):
 
-                current_price = self.pricing_matrix.iloc[i, j]
-                # propagate the previous current_shares to the current period
-                current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i-1, j]
+                current_price = prices[i]
+                active = (current_price != 0) & ~np.isnan(current_shares_with_sign)
 
                 if self.pref.verbose:
-                    print(i, j, entry_price, entry_day_index, rsi[i])
-
-                if pd.isna(current_shares_with_sign.iloc[i-1, j]) or current_price == 0:
-                    continue
-
-                # a position exists already, check if one can exit the current position
-                if current_shares_with_sign.iloc[i-1, j] != 0:
-
-                    ret = 100 * (current_price - entry_price[ticker])/entry_price[ticker]
+                    print(i, entry_price, current_shares_with_sign, rsi[i])
 
-                    # reach target gain or exceed max loss, close position
-                    if ret >= self.target_gain_percentage or ret < self.max_loss_percentage:
+                # a position exists already, close it when it reaches the target gain or exceeds the max loss
+                ret = 100 * (current_price - entry_price)/entry_price
+                close = active & (current_shares_with_sign != 0) & ((ret >= self.target_gain_percentage) | (ret < self.max_loss_percentage))
 
-                        # if it was long, sell
-                        if current_shares_with_sign.iloc[i-1, j] > 0:
-                            tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
+                # no position, long when RSI is below the lower bound, short when it is above the upper bound
+                flat = active & (current_shares_with_sign == 0)
+                open_long = flat & (rsi[i] < self.lower_bound)
+                open_short = flat & ~open_long & (rsi[i] > self.upper_bound)
 
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                        # if it were short, buy back
-                        elif current_shares_with_sign.iloc[i-1, j] < 0:
-                            tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
-
-                            shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
-                            current_shares_with_sign.iloc[i, j] = 0
-
-                # if first time trigger, initialize buy or sell, positive shares for long, negative for short
-                elif rsi.iloc[i] < self.lower_bound:
-
-                    tsignal.iloc[i, j] = 1
-                    taction.iloc[i, j] = cm.TradeAction.BUY.value
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
-
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
-
-                elif rsi.iloc[i] > self.upper_bound and current_shares_with_sign.iloc[i-1, j] == 0:
-
-                    tsignal.iloc[i, j] = -1
-                    taction.iloc[i, j] = cm.TradeAction.SELL.value
+                traded = np.flatnonzero(close | open_long | open_short)
+                if len(traded) == 0:
+                    continue
 
-                    shares.iloc[i, j] = int(dollar_exposure/current_price)
-                    current_shares_with_sign.iloc[i, j] = -1* shares.iloc[i, j]
+                new_shares = np.trunc(dollar_exposure/current_price[traded])
+                order_shares = np.where(close[traded], -current_shares_with_sign[traded],
+                                        np.where(open_long[traded], new_shares, -new_shares))
+                is_buy = open_long[traded] | (close[traded] & (current_shares_with_sign[traded] < 0))
 
-                    entry_day_index[ticker] = i
-                    entry_price[ticker] = self.pricing_matrix.iloc[i, j]
+                date_index.append(np.full(len(traded), i))
+                ticker_index.append(traded)
+                shares_with_sign.append(order_shares)
+                actions.append(np.where(is_buy, cm.TradeAction.BUY.code, cm.TradeAction.SELL.code))
 
-                else:
-                    # no trade (new or closing trades), do nothing except copying previous current shares
-                    pass
+                # closing trades are flat, opening trades hold the new shares
+                current_shares_with_sign[traded] = np.where(close[traded], 0, order_shares)
+                entry_price[traded] = np.where(close[traded], entry_price[traded], current_price[traded])
 
-        # print("tsignal", tsignal)
-        # print("taction", taction)
-        # print("shares", shares)
+        if len(date_index) == 0:
+            return(OrderList([], [], [], []))
 
-        return(tsignal, taction, shares)
+        return(OrderList(np.concatenate(date_index), np.concatenate(ticker_index), np.concatenate(shares_with_sign),
+                         np.concatenate(actions)))
 
 
 
@@ -174,10 +133,8 @@ def _test1():
 
     RSI = RSIStrategy(pref, dm, cm.OneMillion, target_gain_percentage = 1.5, max_loss_percentage = -0.5)
     RSI.validate()
-    tradesignal, tradeaction, shares = RSI.run_model()
-
-    #print(tradeaction.head())
-    #print(shares)
+    orders = RSI.run_model()
+    print(orders.to_frame(RSI.pricing_matrix.index, RSI.pricing_matrix.columns))
 
     RSI.run_strategy()
     print(RSI.performance)
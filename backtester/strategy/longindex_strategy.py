@@ -8,6 +8,7 @@ import pandas as pd
 
 import common as cm
 from strategy import Strategy
+from orderlist import OrderList
 from datamatrix import DataMatrix, DataMatrixLoader
 from preference import Preference
 
@@ -31,28 +32,14 @@ class LongIndexStrategy(Strategy):
         '''
         No external prediction model needed, just buy the index on day 1 and sell at the end
         '''
-        taction = self.pricing_matrix.copy()
-        tsignal = self.pricing_matrix.copy()
-        shares = self.pricing_matrix.copy()
-
-        taction = taction.applymap(lambda x: cm.TradeAction.NONE.value)
-        tsignal *= 0
-        shares  *= 0
-
-
+        nrow = self.pricing_matrix.shape[0]
         col_index = self.pricing_matrix.columns.get_loc(self.index_name)
+        shares = int (self.initial_capital / self.pricing_matrix.iloc[0, col_index])
 
-        # buy on first day
-        tsignal.iloc[0, col_index] = 1
-        taction.iloc[0, col_index] = cm.TradeAction.BUY.value
-        shares.iloc[0, col_index] = int (self.initial_capital / self.pricing_matrix.iloc[0, col_index])
-
-        # sell on last day
-        tsignal.iloc[-1, col_index] = -1
-        taction.iloc[-1, col_index] = cm.TradeAction.SELL_TO_CLOSE_ALL.value
-        shares.iloc[-1, col_index] = shares.iloc[0, col_index]
-
-        return(tsignal, taction, shares)
+        # buy on first day, sell on last day
+        orders = OrderList([0, nrow - 1], [col_index, col_index], [shares, -shares],
+                           [cm.TradeAction.BUY, cm.TradeAction.SELL_TO_CLOSE_ALL])
+        return(orders)
 
 
 
@@ -75,10 +62,9 @@ def _test1():
 
     buyIndex = LongIndexStrategy(pref, dm, cm.OneMillion, index_name = 'SPY')
     buyIndex.validate()
-    tradesignal, tradeaction, shares = buyIndex.run_model()
+    orders = buyIndex.run_model()
 
-    print(tradeaction.head())
-    print(shares)
+    print(orders.to_frame(buyIndex.pricing_matrix.index, buyIndex.pricing_matrix.columns))
 
     buyIndex.run_strategy()
     print(buyIndex.performance)
@@ -2,8 +2,10 @@
 Classes for Buy and Hold
 '''
 
+import os
 import enum
 import datetime
+import numpy as np
 import pandas as pd
 
 import random
@@ -27,9 +29,9 @@ class RandomStrategy(Strategy):
         self.upper_bound = upper_bound
         self.risk_allocation_percentage = risk_allocation_percentage
 
-        # set random seed
-        if pref.random_seed is not None:
-            random.seed(pref.random_seed)
+        # the strategy has its own random generator, so that its draws do not depend on
+        # what else runs before it in the same process
+        self.rng = random.Random(pref.random_seed)
 
     def validate(self):
         '''
@@ -56,7 +58,8 @@ class RandomStrategy(Strategy):
         # when RSI is above 80, trade signal is sell, when RSI is below 20, trade signal is buy
         nrow, ncol   = self.pricing_matrix.shape
 
-        taction = self.pricing_matrix.copy()
+        taction = pd.DataFrame(cm.TradeAction.NONE.code, index = self.pricing_matrix.index,
+                               columns = self.pricing_matrix.columns, dtype = np.int8)
         tsignal = self.pricing_matrix.copy()
         # shares on trade execution
         shares = self.pricing_matrix.copy()
@@ -65,7 +68,6 @@ class RandomStrategy(Strategy):
         current_shares_with_sign = self.pricing_matrix.copy()
         dollar_exposure = self.initial_capital * self.risk_allocation_percentage/100
 
-        taction = taction.map(lambda x: cm.TradeAction.NONE.value)
         tsignal *= 0
         shares  *= 0
         current_shares_with_sign *= 0
@@ -86,7 +88,7 @@ class RandomStrategy(Strategy):
                 # propagate the previous current_shares to the current period
                 current_shares_with_sign.iloc[i, j] = current_shares_with_sign.iloc[i-1, j]
 
-                rnd = random.random()
+                rnd = self.rng.random()
 
                 if self.pref.verbose:
                     print(i, j, entry_price, entry_day_index, rnd)
@@ -98,7 +100,7 @@ class RandomStrategy(Strategy):
                         # if it was long, sell
                         if current_shares_with_sign.iloc[i-1, j] > 0:
                             tsignal.iloc[i, j] = -1
-                            taction.iloc[i, j] = cm.TradeAction.SELL.value
+                            taction.iloc[i, j] = cm.TradeAction.SELL.code
 
                             shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
                             current_shares_with_sign.iloc[i, j] = 0
@@ -106,7 +108,7 @@ class RandomStrategy(Strategy):
                         # if it were short, buy back
                         elif current_shares_with_sign.iloc[i-1, j] < 0:
                             tsignal.iloc[i, j] = 1
-                            taction.iloc[i, j] = cm.TradeAction.BUY.value
+                            taction.iloc[i, j] = cm.TradeAction.BUY.code
 
                             shares.iloc[i, j] = abs(current_shares_with_sign.iloc[i-1, j])
                             current_shares_with_sign.iloc[i, j] = 0
@@ -116,7 +118,7 @@ class RandomStrategy(Strategy):
                 elif rnd > self.upper_bound and current_shares_with_sign.iloc[i-1, j] == 0:
 
                     tsignal.iloc[i, j] = 1
-                    taction.iloc[i, j] = cm.TradeAction.BUY.value
+                    taction.iloc[i, j] = cm.TradeAction.BUY.code
                     shares.iloc[i, j] = int(dollar_exposure/current_price)
                     current_shares_with_sign.iloc[i, j] = shares.iloc[i, j]
 
@@ -126,7 +128,7 @@ class RandomStrategy(Strategy):
                 elif rnd < self.lower_bound and current_shares_with_sign.iloc[i-1, j] == 0:
 
                     tsignal.iloc[i, j] = -1
-                    taction.iloc[i, j] = cm.TradeAction.SELL.value
+                    taction.iloc[i, j] = cm.TradeAction.SELL.code
                     shares.iloc[i, j] = int(dollar_exposure/current_price)
                     current_shares_with_sign.iloc[i, j] = -1* shares.iloc[i, j]
 
@@ -140,6 +142,123 @@ class RandomStrategy(Strategy):
         return(tsignal, taction, shares)
 
 
+class RandomMonteCarlo(RandomStrategy):
+
+    ''' Run num_replicas independent replicas of RandomStrategy at once
+    1. Each replica draws its random numbers from its own numpy generator, spawned from one seed,
+       so a replica gives the same result whatever the number of replicas and the batch size
+    2. The entry and exit rules are applied to a replicas x tickers array, one date at a time
+    3. The output is the distribution of the Cumulative Return, Sharpe Ratio and Maximum Drawdown
+
+    '''
+    def __init__(self, pref, input_datamatrix: DataMatrix, initial_capital: float, num_replicas: int,
+                 price_choice = cm.DataField.close, lower_bound = 0.2, upper_bound = 0.8,
+                 risk_allocation_percentage = 10, seed = None, batch_size = 256):
+        super().__init__(pref, input_datamatrix, initial_capital, price_choice, lower_bound, upper_bound,
+                         risk_allocation_percentage)
+        self.name = 'RandomMonteCarlo'
+        self.num_replicas = num_replicas
+        self.batch_size = batch_size
+
+        # one independent stream per replica. Without a seed, the entropy drawn from the OS
+        # is kept in self.seed so that the run can be reproduced
+        seed_sequence = np.random.SeedSequence(pref.random_seed if seed is None else seed)
+        self.seed = seed_sequence.entropy
+        self.seed_sequences = seed_sequence.spawn(num_replicas)
+        self.replicas = pd.DataFrame(index = pd.RangeIndex(num_replicas, name = 'Replica'),
+                                     columns = list(self.performance), dtype = float)
+
+    def run_strategy(self):
+        '''
+        run the replicas batch by batch and calculate the performance of each of them
+        '''
+        prices = self.pricing_matrix.fillna(0).to_numpy(dtype = float)
+        for start in range(0, self.num_replicas, self.batch_size):
+            seed_sequences = self.seed_sequences[start:start + self.batch_size]
+            total_value = self._run_batch(prices, [np.random.default_rng(s) for s in seed_sequences])
+            self.replicas.iloc[start:start + len(seed_sequences)] = self._calc_replica_stat(total_value)
+
+        self.performance = self.replicas.mean().to_dict()
+
+    def _run_batch(self, prices, generators, block_bytes = 32 * 2**20):
+        '''
+        return the replicas x dates total value of the replicas driven by generators.
+        The random numbers are drawn in blocks of dates to bound the memory, consecutive draws of
+        a generator give the same stream as a single draw
+        '''
+        nrow, ncol = prices.shape
+        num = len(generators)
+        dollar_exposure = self.initial_capital * self.risk_allocation_percentage/100
+        growth = 1 + self.pref.risk_free_rate * self.days_between_periods/365
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            new_shares = np.where(prices != 0, np.trunc(dollar_exposure / prices), 0)
+
+        # position is the state of the strategy, it is reset on a day without price,
+        # holding is the actual number of shares held
+        position = np.zeros((num, ncol))
+        holding = np.zeros((num, ncol))
+        total_value = np.empty((num, nrow))
+
+        # no trade on the first date
+        cash = np.full(num, self.initial_capital * growth)
+        total_value[:, 0] = cash
+
+        block = max(1, block_bytes // (8 * num * max(ncol, 1)))
+        for block_start in range(1, nrow, block):
+            block_end = min(block_start + block, nrow)
+            rnd_block = np.stack([g.random((block_end - block_start, ncol)) for g in generators])
+
+            for i in range(block_start, block_end):
+                price = prices[i]
+                rnd = rnd_block[:, i - block_start]
+                tradable = price != 0
+
+                flat = position == 0
+                close = tradable & ~flat & ((rnd > self.upper_bound) | (rnd < self.lower_bound))
+                open_long = tradable & flat & (rnd > self.upper_bound)
+                open_short = tradable & flat & (rnd < self.lower_bound)
+
+                order = np.where(close, -position, 0) + np.where(open_long, new_shares[i], 0) - \
+                        np.where(open_short, new_shares[i], 0)
+                holding += order
+                position = np.where(tradable, position + order, 0)
+
+                cash = (cash - (order * price).sum(axis = 1)) * growth
+                total_value[:, i] = cash + (holding * price).sum(axis = 1)
+
+        return total_value
+
+    def _calc_replica_stat(self, total_value):
+        '''
+        performance of each replica from its replicas x dates total value, as in Strategy._calc_daily_stat
+        '''
+        cumulative_pnl = total_value - self.initial_capital
+        pnl_returns = np.diff(cumulative_pnl, axis = 1) / total_value[:, 1:]
+
+        result = pd.DataFrame(columns = self.replicas.columns, dtype = float)
+        result['Cumulative Returns'] = 100 * cumulative_pnl[:, -1] / self.initial_capital
+        result['Maximum Drawdown'] = cm.calculate_max_drawdown(total_value, axis = 1)
+        result['Sharpe Ratio'] = cm.calculate_sharpe_ratio(pnl_returns, self.pref.risk_free_rate, axis = 1)
+        return result.to_numpy()
+
+    def get_distribution(self, percentiles = (0.05, 0.25, 0.5, 0.75, 0.95)):
+        '''
+        summary statistics of the performance across replicas
+        '''
+        return self.replicas.describe(percentiles = percentiles)
+
+    def save_to_csv(self, output_dir):
+        '''
+        Save the performance of every replica and its distribution to csv file
+        '''
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        self.replicas.to_csv(os.path.join(output_dir, f"{self.name}_replicas.csv"))
+        self.get_distribution().to_csv(os.path.join(output_dir, f"{self.name}_distribution.csv"))
+
+
 
 def _test1():
 
@@ -170,8 +289,35 @@ def _test1():
     print(f"Saving output to {pref.test_output_dir}")
     RSI.save_to_csv(pref.test_output_dir)
 
+def _test2():
+
+    from preference import Preference
+
+    pref = Preference()
+    pref.random_seed = 1001
+
+    universe = ['AWO', 'BDJ', 'BDTC']
+    start_date = datetime.date(2013, 1, 1)
+    end_date = datetime.date(2023, 1, 1)
+
+    loader = DataMatrixLoader(pref, 'test', universe, start_date, end_date)
+    dm = loader.get_daily_datamatrix()
+
+    mc = RandomMonteCarlo(pref, dm, cm.OneMillion, 100, batch_size = 32)
+    mc.validate()
+    mc.run_strategy()
+    print(mc.get_distribution())
+
+    # a replica does not depend on the batch size
+    mc2 = RandomMonteCarlo(pref, dm, cm.OneMillion, 10, batch_size = 3)
+    mc2.run_strategy()
+    print(np.allclose(mc.replicas.iloc[:10], mc2.replicas))
+
+    mc.save_to_csv(pref.test_output_dir)
+
 def _test():
     _test1()
+    _test2()
 
 
 if __name__ == "__main__":